@@ -1,19 +1,62 @@
+import collections
+
 import numpy as np
 
 import geo
 import human
+import instrument
 
 def gaussian(mu, var):
     return lambda x:  np.exp(-((x - mu)**2)/(2*var**2))/(np.sqrt(2 * np.pi) * var)
 
+def log_gaussian(mu, var):
+    return lambda x: -((x - mu)**2)/(2*var**2) - np.log(np.sqrt(2 * np.pi) * var)
+
+def logsumexp(a, axis=-1, keepdims=False):
+    """
+        log(sum(exp(a))) along axis, without under or overflow
+
+        use to normalize log-probabilities
+    """
+    m = np.max(a, axis=axis, keepdims=True)
+    m = np.where(np.isfinite(m), m, 0)
+
+    with np.errstate(divide='ignore'):
+        s = m + np.log(np.sum(np.exp(a - m), axis=axis, keepdims=True))
+
+    if not keepdims:
+        s = np.squeeze(s, axis=axis)
+    return s
+
 def entropy(beliefs):
     """
         the shannon entropy of a list of nums
+
+        broadcasts over leading axes, the distributions
+        lie along the last axis; zero beliefs contribute
+        nothing (0 log 0 = 0)
     """
-    if not np.isclose(sum(beliefs), 1):
+    beliefs = np.asarray(beliefs)
+    if not np.allclose(np.sum(beliefs, axis=-1), 1):
         raise Exception("entropy: beliefs don't sum to 1!")
 
-    return -sum([b*np.log(b) for b in beliefs])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return -np.sum(np.where(beliefs > 0, beliefs*np.log(beliefs), 0), axis=-1)
+
+def entropy_from_log(log_beliefs):
+    """
+        the shannon entropy of log-probabilities
+
+        stable where entropy(np.exp(log_beliefs)) is not,
+        i.e. beliefs that underflow to zero
+    """
+    log_beliefs = np.asarray(log_beliefs)
+    beliefs = np.exp(log_beliefs)
+    if not np.allclose(np.sum(beliefs, axis=-1), 1):
+        raise Exception("entropy_from_log: beliefs don't sum to 1!")
+
+    with np.errstate(invalid='ignore'):
+        return -np.sum(np.where(beliefs > 0, beliefs*log_beliefs, 0), axis=-1)
 
 # A likelihood is:
 #
@@ -25,40 +68,110 @@ def entropy(beliefs):
 #   >>> l = boltzmann(beta)
 #   ...
 #   >>> p_u_h_given = l(alpha, state, u_h, u_r, goal)
+#
+# A log-likelihood is the same, but returns log P(...),
+# e.g. log_boltzmann(beta). Inference is done with these,
+# in log-space, see log_update.
+#
+# likelihoods broadcast over leading axes like humans do,
+# so stacks of states, controls and goals give a stack of
+# likelihoods. Those marked vectorized are evaluated for
+# all K goals at once, see likelihoods.
+
+def vectorized(likelihood):
+    """
+        vectorized marks likelihood as broadcasting over
+        a (K, 2) matrix of goals
+
+        use to wrap array-native likelihoods, so update
+        calls them once instead of once per goal
+    """
+    likelihood.vectorized = True
+    return likelihood
+
+def exponentiated(log_likelihood):
+    """
+        the likelihood corresponding to a log-likelihood
+    """
+    likelihood = lambda *args: np.exp(log_likelihood(*args))
+    if getattr(log_likelihood, "vectorized", False):
+        likelihood = vectorized(likelihood)
+    return likelihood
+
+def log_boltzmann(beta):
+    """
+        log_boltzmann is the log of the boltzmann distribution
+        observation model, where the human acts approximately
+        optimal according to a cost function, here given by
+        distance to go to goal.
+    """
+    @vectorized
+    def log_likelihood(alpha, state, u_h, past_u_r, goal):
+        return beta*(geo.norm((state + human.optimal(alpha, state, goal)) - goal, axis=-1)
+                     - geo.norm((state + u_h) - goal, axis=-1))
+    log_likelihood.key = ("boltzmann", beta)
+    return log_likelihood
 
 def boltzmann(beta):
     """
         boltzmann is the boltzmann distribution observation
-        model, where the human acts approximately optimal
-        according to a cost function, here given by
-        distance to go to goal.
+        model, see log_boltzmann.
     """
-    def likelihood(alpha, state, u_h, past_u_r, goal):
-        return np.exp(beta*
-                        (geo.norm((state + human.optimal(alpha, state, goal)) - goal)
-                        - geo.norm((state + u_h) - goal))
-                    )
-    return likelihood
+    return exponentiated(log_boltzmann(beta))
 
-def lazy(threshold):
+def log_lazy(threshold):
+    """
+        log_lazy is the log of an observation model based on
+        the expectation that the human will not offer corrective
+        controls if the robot is acting correctly, and will offer
+        overly corrective controls if the robot is acting incorrectly.
     """
-        lazy is an observation model based on the expectation
-        that the human will not offer corrective controls if the
-        robot is acting correctly, and will offer overly corrective
-        controls if the robot is acting incorrectly.
-    """
-    def lazylike(alpha, state, u_h, past_u_r, goal):
-        if human.looks_almost_optimal(alpha, state, goal, past_u_r, threshold):
-            if np.alltrue(np.allclose(u_h, np.zeros(u_h.shape))):
-                return 1.0 - 1e-10
-            else:
-                return 0.0 + 1e-10
-        else:
-            return gaussian(0, np.pi/4)(
+    @vectorized
+    def log_lazylike(alpha, state, u_h, past_u_r, goal):
+        looks = human.looks_almost_optimal(alpha, state, goal, past_u_r, threshold)
+        idle = np.all(np.isclose(u_h, 0), axis=-1)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            corrective = log_gaussian(0, np.pi/4)(
                     geo.angle_between(human.pull_back(alpha, state, goal, past_u_r), u_h)
             )
-    return lazylike
 
+        return np.where(looks,
+                    np.where(idle, np.log(1.0 - 1e-10), np.log(1e-10)),
+                    corrective)
+    log_lazylike.key = ("lazy", threshold)
+    return log_lazylike
+
+def lazy(threshold):
+    """
+        lazy is the lazy observation model, see log_lazy.
+    """
+    return exponentiated(log_lazy(threshold))
+
+@instrument.counted("likelihood", size=np.size)
+def likelihoods(alpha, state, u_h, past_u_r, goals, likelihood):
+    """
+        likelihoods evaluates likelihood for every goal
+
+        state, u_h and past_u_r are vectors, or stacks of them
+        with matching leading axes, goals is a (K, 2) matrix;
+        returns the likelihoods with the goals along a new
+        last axis, e.g. (K,) or (B, K)
+
+        works the same for log-likelihoods
+    """
+    if getattr(likelihood, "vectorized", False):
+        return likelihood(alpha,
+                np.asarray(state)[..., np.newaxis, :],
+                np.asarray(u_h)[..., np.newaxis, :],
+                np.asarray(past_u_r)[..., np.newaxis, :],
+                goals)
+
+    return np.moveaxis(
+            np.array([likelihood(alpha, state, u_h, past_u_r, g) for g in goals]),
+            0, -1)
+
+@instrument.timed("belief.update")
 def update(alpha, state, u_h, past_u_r, goals, beliefs, likelihood):
     """
         update performs a bayesian step update on
@@ -67,11 +180,98 @@ def update(alpha, state, u_h, past_u_r, goals, beliefs, likelihood):
         use to generate the belief update/what the belief
         update would be if you were in one state, saw u_h
         and had the passed in goals and beliefs.
+
+        stacked states and controls give stacked beliefs,
+        see likelihoods.
     """
-    beliefs = np.copy(beliefs)
-    beliefs = [b*likelihood(alpha, state, u_h, past_u_r, g)
-                for (g, b) in zip(goals, beliefs)]
+    beliefs = beliefs * likelihoods(alpha, state, u_h, past_u_r, goals, likelihood)
 
     # normalize!
-    beliefs = beliefs/np.sum(beliefs)
-    return beliefs
+    return beliefs/np.sum(beliefs, axis=-1, keepdims=True)
+
+class Memo:
+    """
+        Memo is a bounded, least recently used, memo of
+        posteriors, keyed on the quantized inputs of an update
+        and the likelihood's key, e.g. ("boltzmann", beta)
+
+        use to share posteriors between the robots' planning,
+        which predicts them, and the updates on the actual
+        observations, see log_update and opt.remember
+    """
+
+    def __init__(self, size=4096, quantum=1e-9):
+        self.size = size
+        self.quantum = quantum
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, log_likelihood, state, u_h, past_u_r, goals, log_beliefs):
+        """
+            key is the key of one update, None if it can't be
+            memoized: a stack of states, or a likelihood without
+            a key
+        """
+        if np.ndim(state) != 1 or not hasattr(log_likelihood, "key"):
+            return None
+
+        values = np.concatenate([np.ravel(state), np.ravel(u_h), np.ravel(past_u_r),
+                                 np.ravel(goals), np.maximum(np.ravel(log_beliefs), -1e3)])
+        return (log_likelihood.key, np.round(values/self.quantum).astype(np.int64).tobytes())
+
+    def get(self, key):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+
+        self.misses += 1
+        return None
+
+    def put(self, key, value):
+        # a copy, so an entry never pins the array value views,
+        # e.g. every posterior predicted in a step
+        self.entries[key] = np.array(value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self.entries),
+        }
+
+@instrument.timed("belief.update")
+def log_update(alpha, state, u_h, past_u_r, goals, log_beliefs, log_likelihood, memo=None):
+    """
+        log_update is update in log-space, it takes and
+        returns log-beliefs and uses a log-likelihood.
+
+        use instead of update when beliefs or likelihoods
+        could underflow: high temperatures, many goals or
+        long horizons.
+
+        memo, a Memo, if given is consulted first and filled
+        after
+    """
+    key = None
+    if memo is not None:
+        key = memo.key(log_likelihood, state, u_h, past_u_r, goals, log_beliefs)
+        if key is not None:
+            posterior = memo.get(key)
+            if posterior is not None:
+                return posterior
+
+    log_beliefs = log_beliefs + likelihoods(alpha, state, u_h, past_u_r, goals, log_likelihood)
+
+    # normalize!
+    posterior = log_beliefs - logsumexp(log_beliefs, axis=-1, keepdims=True)
+
+    if key is not None:
+        memo.put(key, posterior)
+    return posterior
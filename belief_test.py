@@ -1,6 +1,8 @@
 import numpy as np
 
 import belief
+import human
+import sim
 
 def test_entropy():
     cases = [
@@ -17,6 +19,96 @@ def test_entropy():
         if not (np.isclose(got, want)):
             raise Exception("test_entropy: got " + repr(got) + " want " + repr(want))
 
+def test_update():
+    alpha = .1
+    state = np.array([0, .5])
+    goals = np.random.uniform(-1, 1, (50, 2))
+    beliefs = np.ones(50)/50
+    past_u_r = np.array([.1, 0])
+    u_h = human.optimal(alpha, state, goals[0])
+
+    for likelihood in [belief.boltzmann(2.0), belief.lazy(np.pi/4)]:
+        got = belief.update(alpha, state, u_h, past_u_r, goals, beliefs, likelihood)
+
+        per_goal = lambda alpha, state, u_h, past_u_r, g: likelihood(alpha, state, u_h, past_u_r, g)
+        want = belief.update(alpha, state, u_h, past_u_r, goals, beliefs, per_goal)
+
+        if not (got.shape == (50,) and np.allclose(got, want)):
+            raise Exception("test_update: got " + repr(got) + " want " + repr(want))
+
+        # stacked states and controls give stacked beliefs
+        states = np.array([state, state + past_u_r])
+        u_hs = np.array([u_h, -u_h])
+        got = belief.update(alpha, states, u_hs, past_u_r, goals, beliefs, likelihood)
+        want = [belief.update(alpha, s, u, past_u_r, goals, beliefs, likelihood)
+                for (s, u) in zip(states, u_hs)]
+
+        if not (got.shape == (2, 50) and np.allclose(got, want)):
+            raise Exception("test_update: stacked: got " + repr(got) + " want " + repr(want))
+
+def test_log_update():
+    alpha = .1
+    state = np.array([0, .5])
+    goals = np.random.uniform(-1, 1, (50, 2))
+    beliefs = np.ones(50)/50
+    past_u_r = np.array([.1, 0])
+    u_h = human.optimal(alpha, state, goals[0])
+
+    # agrees with update where update is well-behaved
+    got = np.exp(belief.log_update(alpha, state, u_h, past_u_r, goals, np.log(beliefs), belief.log_boltzmann(2.0)))
+    want = belief.update(alpha, state, u_h, past_u_r, goals, beliefs, belief.boltzmann(2.0))
+
+    if not np.allclose(got, want):
+        raise Exception("test_log_update: got " + repr(got) + " want " + repr(want))
+
+    # and stays finite where update underflows
+    log_beliefs = np.log(beliefs)
+    for i in range(500):
+        log_beliefs = belief.log_update(alpha, state, u_h, past_u_r, goals, log_beliefs, belief.log_boltzmann(100.0))
+
+    h = belief.entropy_from_log(log_beliefs)
+    if not (np.all(np.isfinite(log_beliefs[:1])) and np.isfinite(h)):
+        raise Exception("test_log_update: not finite: " + repr(log_beliefs) + " entropy " + repr(h))
+
+def test_memo():
+    goals = np.array([[1, 1], [1, 0]])
+    state = np.array([0, .5])
+    log_b = np.log(np.array([.3, .7]))
+    u_h = human.optimal(.1, state, goals[0])
+    likelihood = belief.log_boltzmann(2.0)
+
+    memo = belief.Memo(size=2)
+    want = belief.log_update(.1, state, u_h, np.zeros(2), goals, log_b, likelihood)
+    for i in range(2):
+        got = belief.log_update(.1, state, u_h, np.zeros(2), goals, log_b, likelihood, memo)
+        if not np.allclose(got, want):
+            raise Exception("test_memo: got " + repr(got) + " want " + repr(want))
+
+    for u in [u_h/2, u_h/3]:
+        belief.log_update(.1, state, u, np.zeros(2), goals, log_b, likelihood, memo)
+
+    if memo.stats() != {"hits": 1, "misses": 3, "rate": .25, "entries": 2}:
+        raise Exception("test_memo: got stats " + repr(memo.stats()))
+
+    # entries don't hold on to the arrays they were views of
+    posteriors = np.zeros((100, 2, 2))
+    memo.put("view", posteriors[3, 1])
+    posteriors[3, 1] = 1
+    if not (memo.get("view").base is None and np.all(memo.get("view") == 0)):
+        raise Exception("test_memo: the entry is a view of the array put")
+
+    # a robot that predicted the human's reaction looks its posterior up
+    ics = sim.load("./.test_examples/active=20.json")
+    want = sim.run(ics)
+    got = sim.run(dict(ics, robot_params=dict(ics["robot_params"], memo=64)))
+
+    if not np.allclose(got["log_beliefs"], want["log_beliefs"]):
+        raise Exception("test_memo: memoized beliefs differ")
+    if got["memo"]["hits"] != len(got["u_r"]) - 1:
+        raise Exception("test_memo: expected a hit on every step after the first, got " + repr(got["memo"]))
+
 if __name__ == '__main__':
     test_entropy()
-
+    test_update()
+    test_log_update()
+    test_memo()
@@ -0,0 +1,342 @@
+import io
+import sys
+import glob
+import json
+import time
+import argparse
+import platform
+import contextlib
+import tracemalloc
+
+import numpy as np
+
+import belief
+import human
+import opt
+import robot
+import sim
+import exp
+
+# Benchmarks of the inference and planning kernels, and of whole
+# simulations and experiments.
+#
+# A sweep times a kernel over a range of one parameter, e.g. the
+# number of controls n, and fits how the time scales: the
+# exponent of a power law, or the factor per step of an
+# exponential (the planning horizon). Results are written as
+# json, to compare later runs against:
+#
+#   python bench.py --out bench.json
+#   python bench.py --compare bench.json
+
+FORMAT = "duo-bench-1"
+
+ALPHA = 0.1
+TEMPERATURE = 2.0
+LAMBDA = 20
+
+def goals_for(K):
+    """
+        K goals spread over the unit circle around the origin
+    """
+    thetas = np.linspace(0, 2*np.pi, K, endpoint=False)
+    return np.stack([np.cos(thetas), np.sin(thetas)], axis=-1)
+
+def problem(K):
+    """
+        the (state, goals, log_beliefs, u_h, past_u_r) of one
+        step towards goal 0, with a uniform prior
+    """
+    goals = goals_for(K)
+    state = np.array([0.1, 0.05])
+    u_h = human.optimal(ALPHA, state, goals[0])
+    return (state, goals, np.full(K, -np.log(K)), u_h, np.zeros(2))
+
+# cases: each maps a parameter value to the function to time
+
+def update(K):
+    (state, goals, log_bs, u_h, past_u_r) = problem(K)
+    log_likelihood = belief.log_boltzmann(TEMPERATURE)
+    return lambda: belief.log_update(ALPHA, state, u_h, past_u_r, goals, log_bs, log_likelihood)
+
+def update_batch(B):
+    (state, goals, log_bs, u_h, past_u_r) = problem(2)
+    states = np.tile(state, (B, 1))
+    u_hs = np.tile(u_h, (B, 1))
+    past_u_rs = np.tile(past_u_r, (B, 1))
+    log_bs = np.tile(log_bs, (B, 1))
+    log_likelihood = belief.log_boltzmann(TEMPERATURE)
+    return lambda: belief.log_update(ALPHA, states, u_hs, past_u_rs, goals, log_bs, log_likelihood)
+
+def entropy_cost(K):
+    (state, goals, log_bs, _, _) = problem(K)
+    return opt.expected_entropy(state, goals, log_bs, ALPHA, belief.log_boltzmann(TEMPERATURE), human.optimal)
+
+def expected_entropy(n, K=2):
+    cost = entropy_cost(K)
+    us = opt.control_set(ALPHA, n).controls
+    return lambda: cost(us)
+
+def expected_entropy_goals(K):
+    return expected_entropy(100, K)
+
+def argmin(n):
+    (state, goals, log_bs, _, _) = problem(2)
+    eq = opt.expected_q_value(state, goals, np.exp(log_bs))
+    ee = entropy_cost(2)
+
+    @opt.vectorized
+    def cost(us):
+        return eq(us) + LAMBDA*ee(us)
+
+    us = opt.control_set(ALPHA, n)
+    return lambda: opt.argmin(us, cost)
+
+def lookahead(horizon):
+    (state, goals, log_bs, _, _) = problem(2)
+    cost = opt.lookahead(state, goals, log_bs, ALPHA, belief.log_boltzmann(TEMPERATURE), human.optimal,
+            LAMBDA, horizon)
+    us = opt.control_set(ALPHA, 100).controls
+    return lambda: cost(us)
+
+def step(optimizer):
+    """
+        one step of the shared robot, belief update and plan,
+        planning with the optimizer of sim.optimizer_for
+    """
+    (state, goals, log_bs, u_h, past_u_r) = problem(2)
+    Fu_r = robot.shared_sampled(belief.log_boltzmann(TEMPERATURE), human.optimal,
+            sim.optimizer_for({"optimizer": optimizer}))
+    return lambda: Fu_r(ALPHA, state, goals, log_bs, past_u_r, u_h)
+
+def simulation(K, n=100, human_model=human.optimal):
+    goals = goals_for(K)
+    log_likelihood = belief.log_boltzmann(TEMPERATURE)
+    Fu_r = robot.active(log_likelihood, human.optimal, LAMBDA, opt.grid(n))
+    prior = np.full(K, 1.0/K)
+    return (np.array([0.0, 0.0]), goals, 0, human_model, Fu_r, prior)
+
+def simulate(n):
+    args = simulation(2, n)
+    return lambda: sim.simulate(*args)
+
+def simulate_goals(K):
+    args = simulation(K)
+    return lambda: sim.simulate(*args)
+
+def simulate_batch(reps):
+    args = simulation(2, human_model=human.fuzz(human.optimal, 0.01))
+    return lambda: sim.simulate_batch(*args, runs=reps)
+
+# name: (parameter, values, quick values, scaling, case)
+SWEEPS = {
+    "belief.update": ("K", [2, 8, 32, 128, 512], [2, 32, 512], "power", update),
+    "belief.update.batch": ("B", [1, 10, 100, 1000, 10000], [1, 100, 10000], "power", update_batch),
+    "opt.expected_entropy": ("n", [10, 30, 100, 300, 1000, 3000], [10, 300, 3000], "power", expected_entropy),
+    "opt.expected_entropy.goals": ("K", [2, 4, 8, 16, 32], [2, 8, 32], "power", expected_entropy_goals),
+    "opt.argmin": ("n", [10, 30, 100, 300, 1000, 3000], [10, 300, 3000], "power", argmin),
+    "opt.lookahead": ("horizon", [1, 2, 3], [1, 2], "exponential", lookahead),
+    "robot.shared.step": ("optimizer", ["grid", "exact"], ["grid", "exact"], None, step),
+    "sim.simulate": ("n", [10, 100, 1000], [10, 1000], "power", simulate),
+    "sim.simulate.goals": ("K", [2, 4, 8, 16], [2, 16], "power", simulate_goals),
+    "sim.simulate_batch": ("reps", [1, 4, 16, 64, 256], [1, 16, 256], "power", simulate_batch),
+}
+
+def seconds(f, target=0.2, repeat=3):
+    """
+        seconds is the best time of one call to f, over repeat
+        rounds of as many calls as take about target seconds
+    """
+    start = time.perf_counter()
+    f()
+    once = time.perf_counter() - start
+
+    number = max(1, int(target / max(once, 1e-9)))
+    best = once
+    for i in range(repeat):
+        start = time.perf_counter()
+        for j in range(number):
+            f()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+def peak_bytes(f):
+    """
+        peak_bytes is the most memory allocated at once by one
+        call to f, numpy arrays included
+    """
+    tracemalloc.start()
+    try:
+        f()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def measure(f, target=0.2):
+    np.random.seed(111)
+    return {"seconds": seconds(f, target), "peak_bytes": peak_bytes(f)}
+
+def fit(values, times, scaling="power"):
+    """
+        fit is the exponent k of times ~ values**k, or, for
+        exponential scaling, the factor k of times ~ k**values
+
+        fits the larger half of the values, where fixed
+        overheads matter least; None with fewer than two points,
+        or no scaling, e.g. for a sweep over choices
+    """
+    if scaling is None or len(values) < 2:
+        return None
+
+    first = min(len(values) // 2, len(values) - 2)
+    x = np.asarray(values[first:], dtype=float)
+    y = np.log(np.asarray(times[first:], dtype=float))
+    if scaling == "power":
+        return float(np.polyfit(np.log(x), y, 1)[0])
+    return float(np.exp(np.polyfit(x, y, 1)[0]))
+
+def sweep(name, quick=False, target=0.2):
+    (param, values, quick_values, scaling, case) = SWEEPS[name]
+    if quick:
+        values = quick_values
+
+    points = []
+    for v in values:
+        point = measure(case(v), target)
+        point["value"] = v
+        points.append(point)
+
+    return {
+        "param": param,
+        "scaling": scaling,
+        "points": points,
+        "fit": fit(values, [p["seconds"] for p in points], scaling),
+    }
+
+def experiment(path, reps=None, target=0.2):
+    """
+        experiment times running every variable of the
+        experiment at path, without its plots
+    """
+    e = sim.load(path)
+    if reps is not None:
+        e["repetitions"] = reps
+    (reps, seed, ics) = exp.parse(e)
+
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            return [exp.repeat(reps, c, exp.seed_for(seed, v, 0)) for (v, (name, c)) in enumerate(ics)]
+
+    point = measure(run, target)
+    point["value"] = reps
+    return {"param": "reps", "scaling": None, "points": [point], "fit": None}
+
+def run(names=None, experiments=(), reps=None, quick=False, target=0.2):
+    """
+        run runs the named sweeps, all of them if names is None,
+        and the experiments, e.g. glob.glob("experiments/*.json")
+
+        returns the benchmarks, as written by save
+    """
+    if names is None:
+        names = sorted(SWEEPS)
+
+    benchmarks = {}
+    for name in names:
+        print(name, file=sys.stderr)
+        benchmarks[name] = sweep(name, quick, target)
+    for path in experiments:
+        print(path, file=sys.stderr)
+        benchmarks[path] = experiment(path, reps, target)
+
+    return {
+        "format": FORMAT,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "benchmarks": benchmarks,
+    }
+
+def save(path, results):
+    with open(path, "w") as f:
+        json.dump(results, f, indent=4)
+
+def load(path):
+    with open(path, "r") as f:
+        results = json.load(f)
+    if results.get("format") != FORMAT:
+        raise Exception("bench.load: " + repr(path) + " is not a " + FORMAT + " file")
+    return results
+
+def compare(baseline, current, tolerance=0.25):
+    """
+        compare lines up the points that baseline and current
+        both measured
+
+        returns a list of (name, value, ratio, regressed), ratio
+        being the current time over the baseline's, regressed
+        if it's more than 1 + tolerance
+    """
+    rows = []
+    for name in sorted(current["benchmarks"]):
+        if name not in baseline["benchmarks"]:
+            continue
+
+        before = {p["value"]: p for p in baseline["benchmarks"][name]["points"]}
+        for p in current["benchmarks"][name]["points"]:
+            if p["value"] not in before:
+                continue
+            ratio = p["seconds"] / before[p["value"]]["seconds"]
+            rows.append((name, p["value"], ratio, ratio > 1 + tolerance))
+    return rows
+
+def report(results):
+    for (name, b) in sorted(results["benchmarks"].items()):
+        scaled = ""
+        if b["fit"] is not None:
+            scaled = ("  ~ " + b["param"] + "^%.2f" if b["scaling"] == "power" else "  ~ %.2f^" + b["param"]) % b["fit"]
+        print(name + scaled)
+        for p in b["points"]:
+            print("    %s=%-6s %10.3fms %10.1fKB" % (b["param"], p["value"], p["seconds"]*1e3, p["peak_bytes"]/1024.0))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="benchmark the kernels, simulations and experiments")
+    parser.add_argument("names", nargs="*",
+            help="sweeps to run (default all): " + ", ".join(sorted(SWEEPS)))
+    parser.add_argument("--experiments", nargs="*", default=None,
+            help="also time these experiments, all of experiments/*.json if none are given")
+    parser.add_argument("--reps", type=int, default=None,
+            help="repetitions to run the experiments with (default their own)")
+    parser.add_argument("--quick", action="store_true",
+            help="sweep fewer points, for a fast check")
+    parser.add_argument("--target", type=float, default=0.2,
+            help="seconds to spend timing each point (default 0.2)")
+    parser.add_argument("--out", default=None,
+            help="write the results as json, e.g. bench.json")
+    parser.add_argument("--compare", default=None,
+            help="compare with a baseline written by --out, failing on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+            help="slowdown over the baseline counted as a regression (default 0.25)")
+    args = parser.parse_args()
+
+    for name in args.names:
+        if name not in SWEEPS:
+            parser.error("unknown sweep " + repr(name))
+
+    experiments = []
+    if args.experiments is not None:
+        experiments = args.experiments or sorted(glob.glob("experiments/*.json"))
+
+    results = run(args.names or None, experiments, args.reps, args.quick, args.target)
+    report(results)
+
+    if args.out is not None:
+        save(args.out, results)
+
+    if args.compare is not None:
+        rows = compare(load(args.compare), results, args.tolerance)
+        for (name, value, ratio, regressed) in rows:
+            print("%-40s %-8s %6.2fx%s" % (name, value, ratio, "  REGRESSED" if regressed else ""))
+
+        if any(regressed for (_, _, _, regressed) in rows):
+            sys.exit(1)
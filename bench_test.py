@@ -0,0 +1,39 @@
+import numpy as np
+
+import bench
+
+def test_fit():
+    values = [10, 100, 1000, 10000]
+    cases = [
+        { "in": (values, [1e-3 * v**2 for v in values], "power"), "want": 2.0 },
+        { "in": (values, [5.0 + 0*v for v in values], "power"), "want": 0.0 },
+        { "in": ([1, 2, 3], [8.0**h for h in [1, 2, 3]], "exponential"), "want": 8.0 },
+    ]
+
+    for case in cases:
+        got = bench.fit(*case["in"])
+        if not np.isclose(got, case["want"]):
+            raise Exception("test_fit: got " + repr(got) + " want " + repr(case["want"]))
+
+def test_compare():
+    def results(times):
+        return {"format": bench.FORMAT, "benchmarks": {
+            "opt.argmin": {"points": [{"value": v, "seconds": t} for (v, t) in times]}}}
+
+    baseline = results([(10, 1.0), (100, 2.0)])
+    current = results([(10, 1.1), (100, 3.0), (1000, 9.0)])
+
+    got = [(name, v, regressed) for (name, v, _, regressed) in bench.compare(baseline, current, 0.25)]
+    want = [("opt.argmin", 10, False), ("opt.argmin", 100, True)]
+    if got != want:
+        raise Exception("test_compare: got " + repr(got) + " want " + repr(want))
+
+def test_sweep():
+    b = bench.sweep("opt.argmin", quick=True, target=0.001)
+    if len(b["points"]) != len(bench.SWEEPS["opt.argmin"][2]) or b["fit"] is None:
+        raise Exception("test_sweep: got " + repr(b))
+
+if __name__ == '__main__':
+    test_fit()
+    test_compare()
+    test_sweep()
@@ -0,0 +1,219 @@
+import os
+import json
+import pickle
+import hashlib
+import tempfile
+
+import numpy as np
+
+import geo
+import human
+import belief
+import opt
+import robot
+import sim
+import policy
+
+# the modules a result depends on, a change to any
+# of their source invalidates every cached result;
+# policy's too, as the compiled robot looks up with it
+MODULES = [geo, human, belief, opt, robot, sim, policy]
+
+_version = None
+
+def version():
+    """
+        version is a stamp of the simulation modules' source
+
+        use to key results, so editing the simulation
+        invalidates them, but editing plots does not
+    """
+    global _version
+    if _version is None:
+        h = hashlib.sha256()
+        for m in MODULES:
+            with open(m.__file__.replace(".pyc", ".py"), 'rb') as f:
+                h.update(f.read())
+        _version = h.hexdigest()
+    return _version
+
+def canonical(value):
+    """
+        canonical is the json of value with sorted keys and
+        no whitespace, so equal conditions hash equally
+    """
+    return json.dumps(value, sort_keys=True, separators=(",", ":"),
+            default=lambda v: np.asarray(v).tolist())
+
+def digest(value):
+    """
+        digest is a hash of value: nested dicts, lists and
+        arrays, e.g. an experiment's results
+
+        use to tell whether results changed, without keeping
+        the old ones around
+    """
+    h = hashlib.sha256()
+
+    def feed(v):
+        if isinstance(v, dict):
+            h.update(b"{")
+            for k in sorted(v):
+                h.update(repr(k).encode())
+                feed(v[k])
+            h.update(b"}")
+        elif isinstance(v, (list, tuple)):
+            h.update(b"[")
+            for x in v:
+                feed(x)
+            h.update(b"]")
+        elif isinstance(v, np.ndarray):
+            h.update((str(v.dtype) + repr(v.shape)).encode())
+            h.update(np.ascontiguousarray(v).tobytes())
+        else:
+            h.update(repr(v).encode())
+
+    feed(value)
+    return h.hexdigest()
+
+def deterministic(ics):
+    """
+        deterministic reports whether a run of the initial
+        conditions has the same result regardless of seed
+
+        only the fuzzed human (optimal, with variance) is random
+    """
+    params = ics.get("human_params", {})
+    return not (ics.get("human") == sim.HUMAN_OPTIMAL and params.get("variance", 0) > 0)
+
+def key(ics, seed, runs=1):
+    """
+        key is the content address of the result of running
+        the initial conditions runs times, seeded with seed
+
+        returns None if the result can't be reproduced, i.e.
+        the conditions are random and there is no seed
+    """
+    if deterministic(ics):
+        seed = None
+    elif seed is None:
+        return None
+
+    # a compiled robot's results depend on its policy file too
+    policy = None
+    if "policy" in ics.get("robot_params", {}):
+        with open(ics["robot_params"]["policy"], 'rb') as f:
+            policy = hashlib.sha256(f.read()).hexdigest()
+
+    return hashlib.sha256(canonical({
+        "conditions": ics,
+        "seed": seed,
+        "runs": runs,
+        "version": version(),
+        "policy": policy,
+    }).encode("utf-8")).hexdigest()
+
+class Cache:
+    """
+        Cache is a directory of pickled results, by key
+
+        the least recently used results are evicted once
+        the directory holds more than max_bytes
+
+        the size of the directory is kept as a running total of
+        the results put, and only listed when that exceeds
+        max_bytes, or every rescan puts, to count what other
+        processes, e.g. parallel workers, put since
+    """
+
+    def __init__(self, path=".cache", max_bytes=1 << 30, rescan=64):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.rescan = rescan
+        self.hits = 0
+        self.misses = 0
+
+        # the running total, None until the directory is listed
+        self.total = None
+        self.puts = 0
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def filename(self, k):
+        return os.path.join(self.path, k + ".pkl")
+
+    def get(self, ics, seed, runs=1):
+        """
+            get returns the cached result, or None
+        """
+        k = key(ics, seed, runs)
+        if k is None:
+            return None
+
+        try:
+            with open(self.filename(k), 'rb') as f:
+                value = pickle.load(f)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return None
+
+        # mark as recently used
+        os.utime(self.filename(k), None)
+        self.hits += 1
+        return value
+
+    def put(self, ics, seed, value, runs=1):
+        """
+            put caches value as the result, if it is reproducible
+        """
+        k = key(ics, seed, runs)
+        if k is None:
+            return
+
+        # write then rename, so concurrent readers never see
+        # a partial result
+        (fd, tmp) = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            size = f.tell()
+        try:
+            replaced = os.path.getsize(self.filename(k))
+        except OSError:
+            replaced = 0
+        os.replace(tmp, self.filename(k))
+
+        self.puts += 1
+        if self.total is None or self.puts % self.rescan == 0:
+            self.evict()
+            return
+
+        self.total += size - replaced
+        if self.total > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """
+            evict removes the least recently used results until
+            the cache fits in max_bytes, and recounts the total
+        """
+        entries = []
+        for name in os.listdir(self.path):
+            if not name.endswith(".pkl"):
+                continue
+            try:
+                st = os.stat(os.path.join(self.path, name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+
+        total = sum([size for (_, size, _) in entries])
+        for (_, size, name) in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.path, name))
+            except OSError:
+                pass
+            total -= size
+        self.total = total
@@ -0,0 +1,116 @@
+import os
+import types
+import shutil
+import tempfile
+
+import numpy as np
+
+import cache
+import policy
+import sim
+
+def test_key():
+    ics = sim.load("./.test_examples/shared.json")
+    noisy = dict(ics, human_params={"variance": 0.01})
+
+    cases = [
+        { "in": (ics, 1), "same": (ics, 2) },
+        { "in": (noisy, 1), "same": (dict(noisy), 1) },
+    ]
+
+    for case in cases:
+        got = cache.key(*case["in"])
+        want = cache.key(*case["same"])
+        if got is None or got != want:
+            raise Exception("test_key: got " + repr(got) + " want " + repr(want))
+
+    if cache.key(noisy, 1) == cache.key(noisy, 2):
+        raise Exception("test_key: random conditions with different seeds share a key")
+
+    if cache.key(noisy, None) is not None:
+        raise Exception("test_key: unseeded random conditions should not be cacheable")
+
+def test_version():
+    if policy not in cache.MODULES:
+        raise Exception("test_version: the compiled robot's results don't depend on policy.py")
+
+    # editing any of the modules changes the version
+    path = tempfile.mkdtemp()
+    modules = cache.MODULES
+    try:
+        edited = os.path.join(path, "policy.py")
+        with open(policy.__file__, 'r') as f:
+            source = f.read()
+        with open(edited, 'w') as f:
+            f.write(source + "\n# edited\n")
+
+        cache._version = None
+        want = cache.version()
+        cache.MODULES = [m for m in modules if m is not policy] + [types.SimpleNamespace(__file__=edited)]
+        cache._version = None
+        if cache.version() == want:
+            raise Exception("test_version: editing policy.py kept the version")
+    finally:
+        cache.MODULES = modules
+        cache._version = None
+        shutil.rmtree(path)
+
+def test_run():
+    path = tempfile.mkdtemp()
+    try:
+        c = cache.Cache(path)
+        ics = sim.load("./.test_examples/active=20.json")
+
+        want = sim.run(ics, cache=c)
+        got = sim.run(ics, cache=c)
+
+        if not (c.hits == 1 and np.allclose(got["trajectory"], want["trajectory"])):
+            raise Exception("test_run: expected a cache hit, hits = " + repr(c.hits))
+    finally:
+        shutil.rmtree(path)
+
+def test_evict():
+    path = tempfile.mkdtemp()
+    try:
+        c = cache.Cache(path, max_bytes=50000)
+        ics = sim.load("./.test_examples/shared.json")
+        ics["human_params"] = {"variance": 0.01}
+
+        for seed in range(20):
+            c.put(ics, seed, np.zeros(1000))
+
+        size = sum([os.path.getsize(os.path.join(path, f)) for f in os.listdir(path)])
+        if size > 50000:
+            raise Exception("test_evict: cache holds " + repr(size) + " bytes, want at most 50000")
+
+        if c.get(ics, 19) is None:
+            raise Exception("test_evict: most recent entry was evicted")
+
+        # the directory is only listed when the running total
+        # is over, or every rescan puts
+        c = cache.Cache(path, max_bytes=1 << 30, rescan=8)
+        listed = [0]
+        evict = c.evict
+        def counted():
+            listed[0] += 1
+            evict()
+        c.evict = counted
+
+        for seed in range(20):
+            c.put(ics, seed, np.zeros(1000))
+        size = sum([os.path.getsize(os.path.join(path, f)) for f in os.listdir(path)])
+        if not (listed[0] == 3 and c.total == size):
+            raise Exception("test_evict: listed " + repr(listed[0]) + " times, want 3, total " + repr(c.total) + " want " + repr(size))
+
+        c.max_bytes = 50000
+        c.put(ics, 20, np.zeros(1000))
+        if not (listed[0] == 4 and c.total <= 50000):
+            raise Exception("test_evict: expected the put over max_bytes to evict, total " + repr(c.total))
+    finally:
+        shutil.rmtree(path)
+
+if __name__ == '__main__':
+    test_key()
+    test_version()
+    test_run()
+    test_evict()
@@ -0,0 +1,164 @@
+import time
+
+import numpy as np
+
+import belief
+import opt
+import sim
+
+# A Controller is a robot for the loop: it keeps the state, the
+# beliefs and its last control between steps, and plans within a
+# deadline, e.g. for teleoperation at 100 Hz:
+#
+#   c = controller.configure(ics)
+#   c.reset()
+#   while ...:
+#       tick = time.perf_counter()
+#       (u_r, coverage) = c.step(u_h, tick + 0.008)
+
+def bit_reversed(n):
+    """
+        bit_reversed is a permutation of range(n) in which every
+        prefix is spread evenly over the range, e.g. for 8:
+        0, 4, 2, 6, 1, 5, 3, 7
+    """
+    bits = max(1, int(np.ceil(np.log2(max(n, 2)))))
+    i = np.arange(1 << bits)
+    r = np.zeros_like(i)
+    for b in range(bits):
+        r |= ((i >> b) & 1) << (bits - 1 - b)
+    return r[r < n]
+
+class Controller:
+    """
+        Controller runs a planning robot (see robot.py) one
+        step at a time, keeping its state between steps
+
+        the robot's objective is minimized over the n controls
+        of opt.control_set(alpha, n), as opt.grid(n) does, but
+        anytime: the previous control first, then the rest in
+        chunks, in an order spreading them around the circle,
+        until the deadline. above 2 dimensions the control set
+        is already spread, and bit reversal keeps it so
+
+        chunks are sized to fit the time left, at the rate the
+        last chunk was evaluated; chunk is the size of the very
+        first, before there is a rate
+    """
+
+    def __init__(self, robot, start, goals, prior, alpha=0.1, n=100, chunk=10, clock=time.perf_counter):
+        if not hasattr(robot, "objective"):
+            raise Exception("controller.Controller: the robot doesn't plan, see robot.py")
+
+        self.robot = robot
+        self.start = np.asarray(start, dtype=float)
+        self.goals = np.asarray(goals)
+        self.prior = np.asarray(prior, dtype=float)
+        self.alpha = alpha
+        self.chunk = chunk
+        self.clock = clock
+
+        # seconds per control evaluated, kept across resets
+        self.rate = None
+
+        # candidates[0] is the previous control, the rest the
+        # control set in the order they're evaluated
+        controls = opt.control_set(alpha, n, d=len(self.start)).controls
+        self.candidates = np.empty((n + 1,) + controls.shape[1:])
+        self.candidates[1:] = controls[bit_reversed(n)]
+        self.costs = np.empty(n + 1)
+
+        self.reset()
+
+    def reset(self, start=None, prior=None):
+        """
+            reset starts over, from start and prior if given,
+            otherwise from the ones the controller was made with
+        """
+        if start is not None:
+            self.start = np.asarray(start, dtype=float)
+        if prior is not None:
+            self.prior = np.asarray(prior, dtype=float)
+
+        self.state = np.copy(self.start)
+        with np.errstate(divide='ignore'):
+            self.log_beliefs = np.log(self.prior)
+        self.past_u_r = np.zeros(self.start.shape)
+        self.previous = None
+        self.coverage = 0.0
+
+    def beliefs(self):
+        return np.exp(self.log_beliefs)
+
+    def step(self, u_h, deadline=None, state=None):
+        """
+            step observes the human's control u_h, updates the
+            beliefs and plans the robot's control
+
+            deadline is the clock time to return by, None to
+            evaluate every candidate. once there is a previous
+            control, nothing is evaluated that wouldn't finish
+            in time, and if nothing would, the previous control
+            is kept; the very first step evaluates at least one
+            control. state, if given, replaces the state the
+            controller tracks, e.g. with a measurement
+
+            returns (u_r, coverage), coverage the fraction of the
+            control set evaluated
+        """
+        if state is not None:
+            self.state = np.asarray(state, dtype=float)
+
+        self.log_beliefs = belief.log_update(self.alpha, self.state, u_h, self.past_u_r,
+                self.goals, self.log_beliefs, self.robot.log_likelihood)
+
+        # the previous control, or a repeat of the first candidate
+        first = 0 if self.previous is not None else 1
+        if self.previous is not None:
+            self.candidates[0] = self.previous
+
+        n = len(self.candidates)
+        done = first
+        if self.previous is None or deadline is None or self.clock() < deadline:
+            cost = self.robot.objective(self.alpha, self.state, self.goals, self.log_beliefs)
+
+            while done < n:
+                size = n - done
+                if deadline is not None:
+                    size = self.chunk
+                    if self.rate is not None:
+                        size = int((deadline - self.clock()) / self.rate)
+                    if size < 1:
+                        if done > first or self.previous is not None:
+                            break
+                        size = 1
+                    size = min(size, n - done)
+
+                tick = self.clock()
+                self.costs[done:done + size] = opt.evaluate(self.candidates[done:done + size], cost)
+                self.rate = max(self.clock() - tick, 1e-9) / size
+                done += size
+
+        if done > first:
+            u_r = np.copy(self.candidates[first + np.argmin(self.costs[first:done])])
+        else:
+            u_r = self.previous
+
+        self.coverage = max(done - 1, 0) / (n - 1)
+        self.previous = u_r
+        self.past_u_r = u_r
+        self.state = self.state + u_r
+        return (u_r, self.coverage)
+
+def configure(ics, alpha=0.1, chunk=10):
+    """
+        configure makes the Controller of the robot of the
+        initial conditions, see sim.configure, over the
+        controls its grid optimizer would enumerate
+    """
+    robot_params = ics.get("robot_params", {})
+    if robot_params.get("optimizer", sim.OPTIMIZER_GRID) != sim.OPTIMIZER_GRID:
+        raise Exception("controller.configure: the controller plans over a grid, not with optimizer " + repr(robot_params["optimizer"]))
+
+    (start, goals, true_goal, human, robot, prior) = sim.configure(ics)
+    return Controller(robot, start, goals, prior, alpha, robot_params.get("controls", 100), chunk)
@@ -0,0 +1,122 @@
+import types
+
+import numpy as np
+
+import geo
+import human
+import opt
+import sim
+import controller
+
+def test_bit_reversed():
+    cases = [
+        (1, [0]),
+        (5, [0, 4, 2, 1, 3]),
+        (8, [0, 4, 2, 6, 1, 5, 3, 7]),
+    ]
+    for (n, want) in cases:
+        got = controller.bit_reversed(n).tolist()
+        if got != want:
+            raise Exception("test_bit_reversed: " + repr(n) + " got " + repr(got) + " want " + repr(want))
+
+    if sorted(controller.bit_reversed(100).tolist()) != list(range(100)):
+        raise Exception("test_bit_reversed: not a permutation of range(100)")
+
+def test_step():
+    ics = sim.load("./.test_examples/active=20.json")
+    (start, goals, true_goal, human_model, robot, prior) = sim.configure(ics)
+    c = controller.configure(ics)
+
+    # without a deadline, the controller is the robot
+    for run in range(2):
+        c.reset()
+        state = np.copy(start)
+        log_beliefs = np.log(prior)
+        past_u_r = np.zeros(2)
+        for i in range(5):
+            u_h = human.optimal(.1, state, goals[true_goal], past_u_r)
+            (want, log_beliefs) = robot(.1, state, goals, log_beliefs, past_u_r, u_h)
+            (got, coverage) = c.step(u_h)
+            if not (np.allclose(got, want) and np.allclose(c.log_beliefs, log_beliefs) and coverage == 1.0):
+                raise Exception("test_step: step " + repr(i) + " got " + repr(got) + " want " + repr(want))
+            state = state + want
+            past_u_r = want
+
+        if not np.allclose(c.state, state):
+            raise Exception("test_step: got state " + repr(c.state) + " want " + repr(state))
+
+def slow(robot, now, seconds):
+    """
+        robot, its objective taking seconds of the clock now
+        per control evaluated
+    """
+    def objective(alpha, state, goals, log_beliefs):
+        cost = robot.objective(alpha, state, goals, log_beliefs)
+
+        @opt.vectorized
+        def timed(us):
+            now[0] += seconds*len(us)
+            return cost(us)
+        return timed
+
+    return types.SimpleNamespace(objective=objective, log_likelihood=robot.log_likelihood)
+
+def test_deadline():
+    ics = sim.load("./.test_examples/active=20.json")
+    (start, goals, true_goal, human_model, robot, prior) = sim.configure(ics)
+
+    # a clock only the objective moves, 1/1024 per control
+    now = [0.0]
+    c = controller.Controller(slow(robot, now, 1/1024.), start, goals, prior, chunk=10)
+    c.clock = lambda: now[0]
+
+    u_h = human.optimal(.1, c.state, goals[true_goal], c.past_u_r)
+    cases = [
+        # the first chunk, then as many as fit
+        (48, 0.48),
+        # out of time, the previous control is kept
+        (0, 0.0),
+        # the previous control, and 4 of the set
+        (5, 0.04),
+        (None, 1.0),
+    ]
+    for (budget, want) in cases:
+        previous = c.previous
+        deadline = None if budget is None else now[0] + budget/1024.
+        (u_r, coverage) = c.step(u_h, deadline)
+        if not (np.isclose(coverage, want) and np.isclose(geo.norm(u_r), .1) and (deadline is None or now[0] <= deadline)):
+            raise Exception("test_deadline: budget " + repr(budget) + " coverage " + repr(coverage) + " want " + repr(want))
+        if budget == 0 and not np.array_equal(u_r, previous):
+            raise Exception("test_deadline: out of time, got " + repr(u_r) + " want the previous " + repr(previous))
+
+    # without a previous control, at least one is evaluated
+    c.reset()
+    (u_r, coverage) = c.step(u_h, now[0])
+    if not (np.isclose(coverage, 0.01) and np.isclose(geo.norm(u_r), .1)):
+        raise Exception("test_deadline: the first step covered " + repr(coverage))
+
+def test_configure():
+    ics = sim.load("./.test_examples/active=20.json")
+    ics["robot_params"] = dict(ics["robot_params"], controls=37)
+    (start, goals, true_goal, human_model, robot, prior) = sim.configure(ics)
+
+    # the controller plans over the conditions' controls
+    c = controller.configure(ics)
+    u_h = human.optimal(.1, start, goals[true_goal])
+    (want, _) = robot(.1, start, goals, np.log(prior), np.zeros(2), u_h)
+    (got, _) = c.step(u_h)
+    if not (len(c.candidates) == 38 and np.allclose(got, want)):
+        raise Exception("test_configure: got " + repr(got) + " want " + repr(want))
+
+    try:
+        controller.configure(dict(ics, robot_params={"lambda": 20, "optimizer": "refine"}))
+        raise Exception("test_configure: configured a controller for refine")
+    except Exception as e:
+        if "grid" not in str(e):
+            raise
+
+if __name__ == '__main__':
+    test_bit_reversed()
+    test_step()
+    test_deadline()
+    test_configure()
@@ -1,15 +1,24 @@
-import sys
-import imp
+import os
+import json
+import inspect
+import hashlib
+import argparse
+import functools
+import itertools
+import importlib.util
+import statistics
 
-import matplotlib.pyplot as plt
+import numpy as np
 
 import sim
-import plot
+import instrument
+import cache as caching
+import store
 
 def replace(d, var):
     for key in d:
         val = d[key]
-        if (type(val) == str or type(val) == unicode) and val[0] == "$":
+        if isinstance(val, str) and val[0] == "$":
             d[key] = var[val]
         if type(val) == dict:
             val = val.copy()
@@ -26,14 +35,329 @@ def expand(ic, variable_set):
     replace(nic, variable_set)
     return nic
 
-def repeat(reps, c):
+def axis(spec, rng):
+    """
+        axis is the values of one sweep axis:
+
+            {"values": [v, ...]}               the values given
+            {"range": [lo, hi, n]}             n evenly spaced values
+            {"range": [lo, hi, n], "scale": "log"}
+                                               n log-spaced values
+            {"random": [lo, hi], "samples": n} n uniform samples,
+                                               "scale": "log" too
+
+        with "form": "prior" every value p becomes the two
+        goal prior [p, 1 - p]
+    """
+    log = spec.get("scale", "linear") == "log"
+
+    if "values" in spec:
+        values = list(spec["values"])
+    elif "range" in spec:
+        (lo, hi, n) = spec["range"]
+        if log:
+            values = np.logspace(np.log10(lo), np.log10(hi), int(n))
+        else:
+            values = np.linspace(lo, hi, int(n))
+    elif "random" in spec:
+        (lo, hi) = spec["random"]
+        n = spec.get("samples", 10)
+        if log:
+            values = np.exp(rng.uniform(np.log(lo), np.log(hi), n))
+        else:
+            values = rng.uniform(lo, hi, n)
+    else:
+        raise Exception("exp.axis: sweep axis " + repr(spec) + " needs 'values', 'range' or 'random'")
+
+    values = [float(v) if isinstance(v, (float, np.floating)) else v for v in values]
+
+    if spec.get("form") == "prior":
+        values = [[p, 1.0 - p] for p in values]
+    return values
+
+def label(point):
+    """
+        label names a sweep point, e.g. lambda=10,temperature=0.5
+    """
+    def show(v):
+        if isinstance(v, list):
+            return "/".join(show(x) for x in v)
+        if isinstance(v, float):
+            return "%g" % v
+        return str(v)
+
+    return ",".join(var.lstrip("$") + "=" + show(v) for (var, v) in point.items())
+
+def sweep(experiment, seed=111):
+    """
+        sweep expands the experiment's "sweep", e.g.
+
+            "sweep": {
+                "$lambda": {"range": [1, 100, 10], "scale": "log"},
+                "$temperature": {"values": [0.5, 1.0, 2.0]},
+                "$variance": {"random": [0.0, 0.05], "samples": 10}
+            }
+
+        to the grid of its axes (see axis), a list of points
+        {"$lambda": 1.0, "$temperature": 0.5, ...}. random axes
+        are sampled from seed, so the same experiment sweeps
+        the same points.
+    """
+    spec = experiment.get("sweep", {})
+    names = list(spec)
+    axes = [axis(spec[var], np.random.default_rng([seed, i])) for (i, var) in enumerate(names)]
+    return [dict(zip(names, values)) for values in itertools.product(*axes)]
+
+def table(experiment):
+    """
+        table is the experiment's conditions: a list of
+        (name, variables), one per variable and sweep point
+    """
+    seed = experiment.get("seed", 111)
+    variables = experiment["variables"]
+    if len(variables) == 0:
+        variables = {"default": {}}
+
+    if "sweep" not in experiment:
+        return list(variables.items())
+
+    points = sweep(experiment, seed)
+    rows = []
+    for (name, vs) in variables.items():
+        for point in points:
+            full = dict(vs)
+            full.update(point)
+            rows.append((label(point) if name == "default" else name + ":" + label(point), full))
+    return rows
+
+def repeat(reps, c, seed=None, cache=None, instrumented=False):
     print(c)
     if reps == 1:
-        return sim.run(c)
+        return sim.run(c, seed, cache, instrumented)
+
+    # every repetition would be the same, run it once
+    if caching.deterministic(c):
+        r = sim.run(c, seed, cache, instrumented)
+        return [dict(r) for i in range(reps)]
+
+    return sim.run_batch(c, reps, seed, cache, instrumented)
+
+def seed_for(seed, variable, rep):
+    """
+        seed_for derives the seed of the batch of a variable's
+        repetitions starting at rep from the experiment's seed
+
+        use so that a batch's results do not depend on which
+        worker, or in which order, it ran
+    """
+    return int(np.random.SeedSequence([seed, variable, rep]).generate_state(1)[0])
+
+# repetitions simulated per batch, the unit of seeding: the
+# results depend on it, but not on how the batches are run
+CHUNK = 32
+
+def run_chunk(task):
+    (c, n, seed, cache, instrumented) = task
+    if caching.deterministic(c):
+        return [sim.run(c, seed, cache, instrumented)]
+    return sim.run_batch(c, n, seed, cache, instrumented)
+
+def parallel(reps, ics, workers, seed, cache=None, instrumented=False, chunk=CHUNK):
+    """
+        parallel runs each variable's repetitions in batches of
+        chunk, each seeded by seed_for(seed, variable, its first
+        repetition), as stream does
+
+        workers is None to run the batches in this process, or
+        the number of processes to fan them out to; the results
+        are the same for any number of workers. deterministic
+        variables are run once, and repeated.
+
+        returns the results in the same structure as repeat
+    """
+    owners = []
+    tasks = []
+    for (v, (name, c)) in enumerate(ics):
+        for first in range(0, 1 if caching.deterministic(c) else reps, chunk):
+            owners.append(v)
+            tasks.append((c, min(chunk, reps - first), seed_for(seed, v, first), cache, instrumented))
+
+    if workers is None or workers == 1:
+        runs = [run_chunk(t) for t in tasks]
     else:
-        return [sim.run(c) for i in range(reps)]
+        import multiprocessing
+
+        chunksize = max(1, len(tasks) // (4 * workers))
+        with multiprocessing.Pool(workers) as pool:
+            runs = pool.map(run_chunk, tasks, chunksize=chunksize)
 
-def run(experiment):
+    rs = {}
+    for (v, batch) in zip(owners, runs):
+        rs.setdefault(v, []).extend(batch)
+
+    results = {}
+    for (v, (name, c)) in enumerate(ics):
+        if caching.deterministic(c):
+            rs[v] = [dict(rs[v][0]) for i in range(reps)]
+        results[name] = rs[v][0] if reps == 1 else rs[v]
+    return results
+
+def stream(reps, c, seed, variable, cache=None, start=0, chunk=CHUNK, instrumented=False):
+    """
+        stream is repeat as a generator, yielding the results
+        of repetitions start, ..., reps - 1 one at a time
+
+        repetitions are simulated in batches of chunk, each
+        seeded by seed_for(seed, variable, first repetition),
+        so resuming from start gives the same results as an
+        uninterrupted stream, or as parallel's with as large
+        batches
+    """
+    if caching.deterministic(c):
+        r = sim.run(c, seed_for(seed, variable, 0), cache, instrumented)
+        for i in range(start, reps):
+            yield dict(r)
+        return
+
+    first = start - start % chunk
+    while first < reps:
+        n = min(chunk, reps - first)
+        rs = sim.run_batch(c, n, seed_for(seed, variable, first), cache, instrumented)
+        for r in rs[start - first:]:
+            yield r
+        start = first = first + n
+
+# metrics adaptive repetitions can target, of one result
+METRICS = {
+    "final_belief": lambda r: np.asarray(r["beliefs"])[-1, r["conditions"]["true_goal"]],
+    "steps": lambda r: len(r["u_r"]),
+}
+
+def interval(values, confidence=0.95):
+    """
+        interval is the (mean, width) of the normal confidence
+        interval of the mean of values; the width is infinite
+        for fewer than two values
+    """
+    values = np.asarray(values, dtype=float)
+    if len(values) < 2:
+        return (float(np.mean(values)) if len(values) else np.nan, np.inf)
+
+    z = statistics.NormalDist().inv_cdf(0.5 + confidence/2)
+    return (float(np.mean(values)), float(2*z*np.std(values, ddof=1)/np.sqrt(len(values))))
+
+def adaptive(spec, c, seed, variable, cache=None, instrumented=False):
+    """
+        adaptive repeats c until the confidence interval of the
+        mean of spec's metric is narrow enough, e.g.
+
+            {"metric": "final_belief", "width": 0.05,
+             "batch": 8, "max": 500, "confidence": 0.95}
+
+        runs batches of spec["batch"] repetitions, the same as
+        stream's, until the interval's width is at most
+        spec["width"] or spec["max"] repetitions ran
+
+        returns the list of results
+    """
+    metric = METRICS[spec["metric"]]
+    batch = spec.get("batch", 8)
+
+    results = []
+    for r in stream(spec.get("max", 500), c, seed, variable, cache, 0, batch, instrumented):
+        results.append(r)
+        if len(results) % batch == 0:
+            if caching.deterministic(c):
+                break
+            (_, width) = interval([metric(r) for r in results], spec.get("confidence", 0.95))
+            if width <= spec["width"]:
+                break
+    return results
+
+def adaptive_seeded(task):
+    (spec, c, seed, variable, cache, instrumented) = task
+    return adaptive(spec, c, seed, variable, cache, instrumented)
+
+def precision(experiment, results):
+    """
+        precision reports how precisely an adaptive experiment's
+        results pin down its metric, per variable:
+        {"runs", "mean", "width"}, see interval
+    """
+    spec = experiment["adaptive"]
+    metric = METRICS[spec["metric"]]
+
+    report = {}
+    for (name, rs) in results.items():
+        rs = rs if isinstance(rs, list) else [rs]
+        values = [metric(r) for r in rs]
+        if all(caching.deterministic(r["conditions"]) for r in rs):
+            values = values[:1]
+        (mean, width) = interval(values, spec.get("confidence", 0.95))
+        report[name] = {"runs": len(values), "mean": mean, "width": width if len(values) > 1 else 0.0}
+    return report
+
+class Summary:
+    """
+        Summary aggregates streamed results without keeping
+        them: the number of runs, the mean number of steps,
+        the mean final belief in the true goal and the mean
+        belief history, per variable
+    """
+
+    def __init__(self):
+        self.runs = {}
+        self.steps = {}
+        self.final = {}
+        self.beliefs = {}
+        self.counts = {}
+
+    def add(self, name, r):
+        b = np.asarray(r["beliefs"])
+        g = r["conditions"]["true_goal"]
+        steps = sim.belief_steps(r)
+
+        self.runs[name] = self.runs.get(name, 0) + 1
+        self.steps[name] = self.steps.get(name, 0) + len(r["u_r"])
+        self.final[name] = self.final.get(name, 0) + b[-1, g]
+
+        # running sums of the belief history by step, over the
+        # runs that recorded each step
+        sums = self.beliefs.get(name, np.zeros((0,) + b.shape[1:]))
+        counts = self.counts.get(name, np.zeros(0))
+        if steps[-1] >= len(sums):
+            sums = np.concatenate([sums, np.zeros((steps[-1] + 1 - len(sums),) + b.shape[1:])])
+            counts = np.concatenate([counts, np.zeros(steps[-1] + 1 - len(counts))])
+        sums[steps] += b
+        counts[steps] += 1
+        self.beliefs[name] = sums
+        self.counts[name] = counts
+
+    def summary(self):
+        """
+            the beliefs are the mean belief at each of the steps
+            any run recorded, belief_steps, e.g. every step
+            unless the conditions keep fewer, see sim.history_for
+        """
+        summary = {}
+        for name in self.runs:
+            steps = np.flatnonzero(self.counts[name])
+            summary[name] = {
+                "runs": self.runs[name],
+                "steps": self.steps[name] / self.runs[name],
+                "final_belief": self.final[name] / self.runs[name],
+                "beliefs": self.beliefs[name][steps] / self.counts[name][steps, np.newaxis],
+                "belief_steps": steps,
+            }
+        return summary
+
+def parse(experiment):
+    """
+        parse checks an experiment and expands its variables,
+        and sweep, see table
+
+        returns (reps, seed, ics), ics a list of (name, conditions)
+    """
     if "name" not in experiment:
         raise Exception()
 
@@ -50,25 +374,304 @@ def run(experiment):
     if "repetitions" in experiment:
         reps = experiment["repetitions"]
 
-    vs = experiment["variables"]
+    seed = 111
+    if "seed" in experiment:
+        seed = experiment["seed"]
+
+    if "adaptive" in experiment:
+        spec = experiment["adaptive"]
+        if spec.get("metric") not in METRICS:
+            raise Exception("exp.parse: adaptive metric must be one of " + repr(sorted(METRICS)))
+        if "width" not in spec:
+            raise Exception("exp.parse: adaptive must specify 'width'")
+
     cs = experiment["conditions"]
+    ics = [(name, expand(cs, vs)) for (name, vs) in table(experiment)]
 
-    if len(experiment["variables"]) == 0:
-        ics = [("default", cs)]
-    else:
-        ics = [(name, expand(cs, vs[name])) for name in vs]
+    return (reps, seed, ics)
 
-    results = {name: repeat(reps, c) for (name, c) in ics}
+# the plot modules, whose source every figure depends on
+PLOT_MODULES = ["plot.py", "duo.py"]
+MANIFEST = "plots/.manifest.json"
 
-    if len(experiment["plots"]) == 0:
-        return
+@functools.lru_cache(maxsize=None)
+def companion(name):
+    """
+        companion loads experiments/<name>.py, the functions
+        plotting the experiment's results, once per process
+    """
+    spec = importlib.util.spec_from_file_location(name, os.path.join("experiments", name + ".py"))
+    m = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(m)
+    return m
+
+def figure(name, p):
+    return "plots/" + name + "-" + p
+
+# the (experiment, results) render draws, set in each worker
+_rendering = None
+
+def _render_with(experiment, results):
+    global _rendering
+    _rendering = (experiment, results)
 
-    search = imp.find_module(experiment["name"], ["./experiments/"])
-    m = imp.load_module(experiment["name"], *search)
+def render(p):
+    """
+        render makes the plot p of the experiment being
+        rendered and saves it, with matplotlib's non-interactive
+        backend
+    """
+    # imported here, so that simulating without plots doesn't
+    # pay for loading matplotlib and the fonts
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    import plot
 
+    (experiment, results) = _rendering
+    f = getattr(companion(experiment["name"]), p)(plt, plot, results)
+    f.savefig(figure(experiment["name"], p), transparent=True)
+    plt.close(f)
+    return p
+
+def fingerprints(experiment, results):
+    """
+        fingerprints hashes, for every plot of the experiment,
+        what its figure depends on: the results, the plot
+        function's source and the plot modules' source
+    """
+    h = hashlib.sha256(caching.digest({name: [{k: r[k] for k in r if k != "instrumentation"}
+                                                for r in (rs if isinstance(rs, list) else [rs])]
+                                        for (name, rs) in results.items()}).encode())
+    here = os.path.dirname(os.path.abspath(__file__))
+    for path in PLOT_MODULES:
+        with open(os.path.join(here, path), 'rb') as f:
+            h.update(f.read())
+
+    m = companion(experiment["name"])
+    prints = {}
     for p in experiment["plots"]:
-        f = getattr(m, p)(plt, plot, results)
-        f.savefig("plots/" + experiment["name"] + "-" + p, transparent=True)
+        hp = h.copy()
+        hp.update(inspect.getsource(getattr(m, p)).encode())
+        prints[p] = hp.hexdigest()
+    return prints
+
+def plots(experiment, results, workers=None):
+    """
+        plots makes the experiment's plots of results, with
+        the functions in its companion file
+
+        plots whose figure is up to date, made from the same
+        results by the same source, are skipped; the rest are
+        rendered on a pool of workers processes, by default
+        one per cpu
+
+        returns the plots it rendered
+    """
+    if len(experiment["plots"]) == 0:
+        return []
+
+    name = experiment["name"]
+    prints = fingerprints(experiment, results)
+    manifest = {}
+    if os.path.exists(MANIFEST):
+        with open(MANIFEST, 'r') as f:
+            manifest = json.load(f)
+
+    todo = [p for p in experiment["plots"]
+                if manifest.get(figure(name, p)) != prints[p] or not os.path.exists(figure(name, p) + ".png")]
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(todo))
+
+    if workers <= 1:
+        _render_with(experiment, results)
+        done = [render(p) for p in todo]
+    else:
+        import multiprocessing
+
+        with multiprocessing.Pool(workers, initializer=_render_with, initargs=(experiment, results)) as pool:
+            done = pool.map(render, todo)
+
+    # re-read, other experiments may have been plotted meanwhile
+    if os.path.exists(MANIFEST):
+        with open(MANIFEST, 'r') as f:
+            manifest = json.load(f)
+    for p in done:
+        manifest[figure(name, p)] = prints[p]
+    with open(MANIFEST + ".tmp", 'w') as f:
+        json.dump(manifest, f, indent=4, sort_keys=True)
+    os.replace(MANIFEST + ".tmp", MANIFEST)
+
+    return done
+
+def run(experiment, workers=None, cache=None, out=None, instrumented=False, headless=False):
+    """
+        run runs an experiment and makes its plots, unless
+        headless
+
+        workers is None to run each variable's repetitions in
+        this process, or the number of processes to fan them
+        out to, in batches; the results are the same either
+        way, see parallel
+
+        cache is an optional cache.Cache of results
+
+        out is an optional directory to save the results to,
+        as a store, see store.write
+
+        instrumented records each run's timings and counts,
+        see instrumentation
+
+        an experiment with "adaptive" runs as many repetitions
+        of each variable as its metric needs, see adaptive and
+        precision
+    """
+    (reps, seed, ics) = parse(experiment)
+
+    if "adaptive" in experiment:
+        tasks = [(experiment["adaptive"], c, seed, v, cache, instrumented) for (v, (name, c)) in enumerate(ics)]
+        if workers is None or workers == 1:
+            runs = [adaptive_seeded(t) for t in tasks]
+        else:
+            import multiprocessing
+
+            with multiprocessing.Pool(workers) as pool:
+                runs = pool.map(adaptive_seeded, tasks)
+        results = {name: rs for ((name, c), rs) in zip(ics, runs)}
+    else:
+        results = parallel(reps, ics, workers, seed, cache, instrumented)
+
+    if out is not None:
+        store.write(out, results)
+
+    if not headless:
+        plots(experiment, results)
+    return results
+
+def instrumentation(results):
+    """
+        instrumentation totals the instrumentation of an
+        instrumented run's results per variable, see
+        instrument.aggregate
+    """
+    return {name: instrument.aggregate(rs if isinstance(rs, list) else [rs])
+                for (name, rs) in results.items()}
+
+def run_stream(experiment, out, cache=None, chunk=None, headless=False):
+    """
+        run_stream runs an experiment like run, but appends each
+        run to the store at out as it finishes, instead of
+        keeping the results in memory
+
+        if out already holds some of the runs, e.g. from an
+        interrupted run_stream, only the rest are simulated
+
+        chunk is the repetitions per batch, see stream; None
+        for the store's, or CHUNK for a new store. the runs are
+        seeded by their batch, so a store isn't resumed with
+        a different chunk than it was streamed with
+
+        the plots are made from the memory-mapped store,
+        unless headless
+
+        returns the Summary of the runs
+    """
+    (reps, seed, ics) = parse(experiment)
+    summary = Summary()
+
+    with store.Writer(out, resume=True) as w:
+        stored = w.index.get("chunk")
+        if chunk is None:
+            chunk = stored if stored is not None else CHUNK
+        if w.index["runs"] > 0 and stored != chunk:
+            raise Exception("exp.run_stream: " + repr(out) + " was streamed in chunks of " + repr(stored)
+                    + ", can't resume it in chunks of " + repr(chunk))
+        w.index["chunk"] = chunk
+
+        for (name, c) in ics:
+            if w.count(name) > 0 and w.index["conditions"][name] != c:
+                raise Exception("exp.run_stream: " + repr(out) + " holds different conditions for " + repr(name))
+
+        # runs persisted by an earlier, interrupted, stream
+        if w.index["runs"] > 0:
+            s = store.load(out)
+            for i in range(len(s)):
+                summary.add(s.variables[s.runs[i, 0]], s.result(i, ["beliefs", "u_r"]))
+
+        for (v, (name, c)) in enumerate(ics):
+            done = w.count(name)
+            for (i, r) in enumerate(stream(reps, c, seed, v, cache, done, chunk), done):
+                w.append(name, i, r)
+                w.flush()
+                summary.add(name, r)
+
+    if not headless:
+        plots(experiment, store.load(out).results())
+    return summary
 
 if __name__ == '__main__':
-    run(sim.load(sys.argv[1]))
+    parser = argparse.ArgumentParser(description="run an experiment and plot its results")
+    parser.add_argument("experiment", help="experiment json file, e.g. experiments/teleop.json")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+            help="run the repetitions on a pool of this many processes")
+    parser.add_argument("--cache", default=".cache",
+            help="directory of cached results (default .cache)")
+    parser.add_argument("--cache-size", type=int, default=1024,
+            help="most megabytes of results to keep cached (default 1024)")
+    parser.add_argument("--no-cache", action="store_true",
+            help="always simulate, don't read or write cached results")
+    parser.add_argument("--store", default=None,
+            help="save the results to a store in this directory, e.g. results/")
+    parser.add_argument("--stream", action="store_true",
+            help="append each run to the store as it finishes, resuming an interrupted run (needs --store)")
+    parser.add_argument("--chunk", type=int, default=None,
+            help="repetitions simulated per batch when streaming (default the store's, or 32)")
+    parser.add_argument("--no-plots", action="store_true",
+            help="only simulate, don't load matplotlib or make the plots")
+    parser.add_argument("--instrument", action="store_true",
+            help="time the phases of every step and print the totals (bypasses the cache)")
+    args = parser.parse_args()
+
+    if args.stream and args.store is None:
+        parser.error("--stream needs --store")
+    if args.stream and args.instrument:
+        parser.error("--instrument can't be used with --stream")
+
+    cache = None
+    if not args.no_cache:
+        cache = caching.Cache(args.cache, args.cache_size << 20)
+
+    experiment = sim.load(args.experiment)
+
+    out = None
+    if args.store is not None:
+        out = os.path.join(args.store, experiment["name"])
+
+    if args.stream:
+        summary = run_stream(experiment, out, cache=cache, chunk=args.chunk, headless=args.no_plots).summary()
+        for name in summary:
+            print(name + ": " + repr(summary[name]["runs"]) + " runs, "
+                    + repr(summary[name]["steps"]) + " steps, "
+                    + repr(summary[name]["final_belief"]) + " final belief in the true goal")
+    else:
+        results = run(experiment, workers=args.workers, cache=cache, out=out, instrumented=args.instrument,
+                headless=args.no_plots)
+
+        if "adaptive" in experiment:
+            report = precision(experiment, results)
+            for name in report:
+                p = report[name]
+                print(name + ": " + experiment["adaptive"]["metric"] + " " + "%.4g" % p["mean"]
+                        + " +/- " + "%.4g" % (p["width"]/2) + " after " + repr(p["runs"]) + " runs")
+
+        if args.instrument:
+            totals = instrumentation(results)
+            for name in totals:
+                t = totals[name]
+                print(name + ": " + repr(t["runs"]) + " runs, " + repr(t["steps"]) + " steps")
+                for phase in sorted(t["phases"], key=lambda p: -t["phases"][p]):
+                    print("    " + phase + ": " + "%.3fs" % t["phases"][phase])
+                for count in sorted(t["counts"]):
+                    print("    " + count + ": " + repr(int(t["counts"][count])))
@@ -1,4 +1,14 @@
+import os
+import sys
+import shutil
+import subprocess
+import tempfile
+
+import numpy as np
+
 import exp
+import sim
+import store
 
 def test_replace():
     cases = [
@@ -27,6 +37,183 @@ def test_replace():
         except Exception as e:
             print("exp_test.test_replace: case: " + repr(i) + ": " + repr(e))
 
+def test_parallel():
+    experiment = sim.load("./experiments/boltzmann-noisy-human.json")
+    cs = experiment["conditions"]
+    ics = [(name, exp.expand(cs, experiment["variables"][name])) for name in experiment["variables"]]
+
+    # the same for any number of workers, or none, as exp.run
+    # runs them; and the same as a stream's
+    experiment["plots"] = []
+    experiment["repetitions"] = 5
+    for chunk in [exp.CHUNK, 2]:
+        want = exp.parallel(5, ics, None, 111, chunk=chunk)
+        runs = [exp.parallel(5, ics, 1, 111, chunk=chunk), exp.parallel(5, ics, 3, 111, chunk=chunk)]
+        runs += [{name: list(exp.stream(5, c, 111, v, chunk=chunk)) for (v, (name, c)) in enumerate(ics)}]
+        if chunk == exp.CHUNK:
+            runs += [exp.run(experiment, headless=True), exp.run(experiment, workers=2, headless=True)]
+
+        for got in runs:
+            for (name, c) in ics:
+                if not len(got[name]) == len(want[name]) == 5:
+                    raise Exception("exp_test.test_parallel: " + repr(name) + ": wrong number of repetitions")
+
+                for (a, b) in zip(got[name], want[name]):
+                    if not (len(a["trajectory"]) == len(b["trajectory"]) and np.allclose(a["trajectory"], b["trajectory"])):
+                        raise Exception("exp_test.test_parallel: " + repr(name) + ": chunk " + repr(chunk) + ": results depend on the number of workers")
+
+def test_stream_resume():
+    experiment = sim.load("./experiments/boltzmann-noisy-human.json")
+    experiment["plots"] = []
+    experiment["repetitions"] = 10
+
+    path = tempfile.mkdtemp()
+    try:
+        whole = os.path.join(path, "whole")
+        resumed = os.path.join(path, "resumed")
+
+        exp.run_stream(experiment, whole, chunk=4)
+
+        # interrupt the first variable after 6 repetitions, mid-way
+        # through a chunk, leaving a partially written run behind
+        (reps, seed, ics) = exp.parse(experiment)
+        (name, c) = ics[0]
+        with store.Writer(resumed) as w:
+            w.index["chunk"] = 4
+            for (i, r) in enumerate(exp.stream(reps, c, seed, 0, chunk=4)):
+                if i == 6:
+                    break
+                w.append(name, i, r)
+                w.flush()
+        with open(os.path.join(resumed, "trajectory.f8"), 'ab') as f:
+            f.write(np.zeros(7).tobytes())
+
+        # a different chunk would seed the rest differently
+        try:
+            exp.run_stream(experiment, resumed, chunk=8)
+            raise Exception("exp_test.test_stream_resume: resumed in a different chunk")
+        except Exception as e:
+            if "can't resume" not in str(e):
+                raise
+
+        summary = exp.run_stream(experiment, resumed).summary()
+
+        a = store.load(whole).results()
+        b = store.load(resumed).results()
+        for name in a:
+            if not (len(a[name]) == len(b[name]) == 10 and summary[name]["runs"] == 10):
+                raise Exception("exp_test.test_stream_resume: " + repr(name) + ": wrong number of repetitions")
+
+            for (x, y) in zip(a[name], b[name]):
+                if not (x["trajectory"].shape == y["trajectory"].shape and np.allclose(x["trajectory"], y["trajectory"])):
+                    raise Exception("exp_test.test_stream_resume: " + repr(name) + ": resumed results differ")
+    finally:
+        shutil.rmtree(path)
+
+def test_headless():
+    code = "import sys, exp; sys.exit('matplotlib' in sys.modules)"
+    if subprocess.call([sys.executable, "-c", code]) != 0:
+        raise Exception("exp_test.test_headless: importing exp loads matplotlib")
+
+def test_fingerprints():
+    experiment = sim.load("./experiments/teleop.json")
+    results = {"low": sim.run(exp.expand(experiment["conditions"], experiment["variables"]["low"]))}
+    changed = {"low": dict(results["low"], trajectory=results["low"]["trajectory"][:-1])}
+    instrumented = {"low": dict(results["low"], instrumentation={"steps": 1})}
+
+    want = exp.fingerprints(experiment, results)
+    if exp.companion("teleop") is not exp.companion("teleop"):
+        raise Exception("exp_test.test_fingerprints: companion loaded twice")
+    if exp.fingerprints(experiment, instrumented) != want:
+        raise Exception("exp_test.test_fingerprints: instrumentation changed the fingerprints")
+    if exp.fingerprints(experiment, changed)["basic"] == want["basic"]:
+        raise Exception("exp_test.test_fingerprints: changed results kept their fingerprint")
+
+def test_sweep():
+    experiment = sim.load("./experiments/boltzmann-vary-lambda.json")
+    experiment["conditions"]["robot_params"] = {"lambda": "$lambda"}
+    experiment["conditions"]["human_params"] = {"variance": "$variance"}
+    experiment["conditions"]["prior"] = "$prior"
+    experiment["variables"] = {"active": {"$robot": "active"}, "shared": {"$robot": "shared"}}
+    experiment["sweep"] = {
+        "$lambda": {"range": [1, 100, 3], "scale": "log"},
+        "$variance": {"random": [0.0, 0.02], "samples": 2},
+        "$prior": {"values": [0.3], "form": "prior"},
+    }
+
+    rows = exp.table(experiment)
+    if len(rows) != 2*3*2*1:
+        raise Exception("exp_test.test_sweep: expanded to " + repr(len(rows)) + " conditions, want 12")
+
+    (name, vs) = rows[0]
+    if not (name.startswith("active:lambda=1,variance=") and vs["$prior"] == [0.3, 0.7] and vs["$lambda"] == 1.0):
+        raise Exception("exp_test.test_sweep: got " + repr(rows[0]))
+
+    if [vs for (_, vs) in exp.table(experiment)] != [vs for (_, vs) in rows]:
+        raise Exception("exp_test.test_sweep: random axes differ between expansions")
+
+    (reps, seed, ics) = exp.parse(experiment)
+    ics = ics[:4]
+    serial = {name: exp.repeat(2, c, exp.seed_for(seed, v, 0)) for (v, (name, c)) in enumerate(ics)}
+    pooled = exp.parallel(2, ics, 2, seed)
+    for (name, c) in ics:
+        for (a, b) in zip(serial[name], pooled[name]):
+            if not np.allclose(a["trajectory"], b["trajectory"]):
+                raise Exception("exp_test.test_sweep: " + repr(name) + ": pooled results differ from serial")
+
+def test_adaptive():
+    experiment = sim.load("./experiments/boltzmann-noisy-human.json")
+    (reps, seed, ics) = exp.parse(experiment)
+    (name, c) = ics[0]
+
+    cases = [
+        { "in": {"metric": "final_belief", "width": 1.0, "batch": 4, "max": 12}, "want": 4 },
+        { "in": {"metric": "final_belief", "width": 0.0, "batch": 4, "max": 12}, "want": 12 },
+        # every run takes as many steps: one batch meets any width
+        { "in": {"metric": "steps", "width": 0.0, "batch": 5, "max": 12}, "want": 5 },
+    ]
+
+    for case in cases:
+        rs = exp.adaptive(case["in"], c, seed, 0)
+        if len(rs) != case["want"]:
+            raise Exception("exp_test.test_adaptive: ran " + repr(len(rs)) + " repetitions, want " + repr(case["want"]))
+
+        p = exp.precision(dict(experiment, adaptive=case["in"]), {name: rs})[name]
+        (mean, width) = exp.interval([exp.METRICS[case["in"]["metric"]](r) for r in rs])
+        if not (p["runs"] == len(rs) and np.isclose(p["mean"], mean) and np.isclose(p["width"], width)):
+            raise Exception("exp_test.test_adaptive: got precision " + repr(p))
+
+    # the first batch is the same as a fixed run of as many repetitions
+    fixed = exp.repeat(4, c, exp.seed_for(seed, 0, 0))
+    for (a, b) in zip(fixed, exp.adaptive(cases[0]["in"], c, seed, 0)):
+        if not np.allclose(a["trajectory"], b["trajectory"]):
+            raise Exception("exp_test.test_adaptive: adaptive repetitions differ from fixed ones")
+
+def test_summary():
+    ics = sim.load("./.test_examples/shared.json")
+    ics["history"] = {"beliefs_every": 10}
+
+    # runs of 23 and 11 steps keep the beliefs of steps
+    # [0, 10, 20, 23] and [0, 10, 11]
+    def run(steps, values):
+        beliefs = np.stack([values, 1 - np.asarray(values)], axis=-1)
+        return {"conditions": ics, "u_r": np.zeros((steps, 2)), "beliefs": beliefs}
+
+    s = exp.Summary()
+    s.add("v", run(23, [.5, .6, .7, .8]))
+    s.add("v", run(11, [.5, .4, .3]))
+    got = s.summary()["v"]
+
+    if not (list(got["belief_steps"]) == [0, 10, 11, 20, 23]
+            and np.allclose(got["beliefs"][:, 0], [.5, .5, .3, .7, .8])):
+        raise Exception("test_summary: got " + repr(got))
 
 if __name__ == "__main__":
     test_replace()
+    test_parallel()
+    test_stream_resume()
+    test_headless()
+    test_fingerprints()
+    test_sweep()
+    test_adaptive()
+    test_summary()
@@ -3,9 +3,18 @@ import numpy as np
 norm = np.linalg.norm
 
 def angle_between(v1, v2):
-    if norm(v1) == 0 or norm(v2) == 0:
-        return np.pi
+    """
+        the angle between v1 and v2, pi if either is zero
 
-    v1_u = v1 / norm(v1)
-    v2_u = v2 / norm(v2)
-    return np.arccos(np.clip(np.dot(v1_u, v2_u), -1.0, 1.0))
+        broadcasts over leading axes, e.g. v1 and v2 can be
+        (n, d) matrices of vectors, giving the (n,) angles
+    """
+    n1 = norm(v1, axis=-1)
+    n2 = norm(v2, axis=-1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        v1_u = v1 / n1[..., np.newaxis]
+        v2_u = v2 / n2[..., np.newaxis]
+        angle = np.arccos(np.clip(np.sum(v1_u*v2_u, axis=-1), -1.0, 1.0))
+
+    return np.where((n1 == 0) | (n2 == 0), np.pi, angle)
@@ -25,5 +25,16 @@ def test_angle_between():
         if not (got == want):
             raise Exception("test_angle_between")
 
+def test_angle_between_broadcast():
+    v1 = np.array([[1, 0], [0, 1], [0, 0], [-1, 1]])
+    v2 = np.array([0, 1])
+
+    got = geo.angle_between(v1, v2)
+    want = np.array([geo.angle_between(v, v2) for v in v1])
+
+    if not (got.shape == (4,) and np.allclose(got, want)):
+        raise Exception("test_angle_between_broadcast: got " + repr(got) + " want " + repr(want))
+
 if __name__ == '__main__':
     test_angle_between()
+    test_angle_between_broadcast()
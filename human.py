@@ -5,6 +5,10 @@ import opt
 
 # A human is a function:
 #   H: (alpha, state, goal, u_r) -> (action)
+#
+# humans broadcast over leading axes: state, goal and u_r
+# can be stacks of vectors, e.g. (n, K, 2), giving a stack
+# of actions. The vectors may have any number of dimensions.
 
 def optimal(alpha, state, goal, _u_r=None):
     """
@@ -18,7 +22,7 @@ def optimal(alpha, state, goal, _u_r=None):
         use to get the control that an optimal agent
         acting with a particular goal would do.
     """
-    return ((goal - state)/geo.norm(goal - state))*alpha
+    return ((goal - state)/geo.norm(goal - state, axis=-1, keepdims=True))*alpha
 
 def optimal_sampled(n):
     """
@@ -29,7 +33,9 @@ def optimal_sampled(n):
             h = forget_u_r(optimal_sampled(num_samples))
     """
     def control(alpha, state, goal, _u_r):
-        return opt.argmin(sample_controls(alpha, n), opt.q_value(state, goal))
+        return opt.argmin(opt.sample_controls(alpha, n, np.shape(state)[-1]), opt.q_value(state, goal))
+
+    return control
 
 def pull_back(alpha, state, goal, u_r):
     """
@@ -37,7 +43,7 @@ def pull_back(alpha, state, goal, u_r):
         how should the human react?
     """
     center = - u_r + optimal(alpha, state, goal)
-    return alpha*center/geo.norm(center)
+    return alpha*center/geo.norm(center, axis=-1, keepdims=True)
 
 def looks_almost_optimal(alpha, state, goal, past_u_r, threshold):
     """
@@ -52,10 +58,14 @@ def lazy(threshold):
     """
 
     def lazy(alpha, state, goal, past_u_r):
-        if looks_almost_optimal(alpha, state, goal, past_u_r, threshold):
-            return np.zeros(past_u_r.shape)
-        else:
-            return pull_back(alpha, state, goal, past_u_r)
+        looks = looks_almost_optimal(alpha, state, goal, past_u_r, threshold)
+
+        # pull_back is undefined where the robot is exactly optimal,
+        # but those are the entries where the human stays idle
+        with np.errstate(divide='ignore', invalid='ignore'):
+            back = pull_back(alpha, state, goal, past_u_r)
+
+        return np.where(looks[..., np.newaxis], 0.0, back)
 
     return lazy
 
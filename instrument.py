@@ -0,0 +1,146 @@
+import time
+import functools
+import contextlib
+
+import numpy as np
+
+# Instrumentation is opt-in: while a Recorder is active (see
+# recording), the functions decorated with timed and counted
+# report to it, otherwise they only pay for one check of the
+# module-level recorder.
+#
+# Times are exclusive: a phase called from within another, e.g.
+# belief.update from within opt.expected_entropy, counts towards
+# itself only.
+
+recorder = None
+
+class Recorder:
+    """
+        Recorder accumulates per-step wall time per phase and
+        event counts, e.g. likelihood evaluations
+
+        hooks are called at the end of every step with
+        (recorder, iteration, state, log_beliefs, u_h, u_r)
+    """
+
+    def __init__(self, hooks=None):
+        self.hooks = hooks if hooks is not None else []
+        self.stack = []
+        self.times = {}
+        self.counts = {}
+        self.steps = []
+
+    def enter(self, name):
+        self.stack.append([name, time.perf_counter(), 0.0])
+
+    def exit(self):
+        (name, start, nested) = self.stack.pop()
+        elapsed = time.perf_counter() - start
+        self.times[name] = self.times.get(name, 0.0) + elapsed - nested
+        if self.stack:
+            self.stack[-1][2] += elapsed
+
+    def count(self, name, n=1):
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def step(self, iteration, state, log_beliefs, u_h, u_r):
+        """
+            step closes the current step's record
+        """
+        self.steps.append((self.times, self.counts))
+        self.times = {}
+        self.counts = {}
+        for hook in self.hooks:
+            hook(self, iteration, state, log_beliefs, u_h, u_r)
+
+    def summary(self):
+        """
+            summary is the record as arrays over steps:
+            {"steps": n, "phases": {name: (n,) seconds},
+             "counts": {name: (n,) counts}}
+        """
+        phases = sorted(set([name for (times, _) in self.steps for name in times]))
+        counts = sorted(set([name for (_, cs) in self.steps for name in cs]))
+        return {
+            "steps": len(self.steps),
+            "phases": {name: np.array([times.get(name, 0.0) for (times, _) in self.steps]) for name in phases},
+            "counts": {name: np.array([cs.get(name, 0) for (_, cs) in self.steps]) for name in counts},
+        }
+
+@contextlib.contextmanager
+def recording(r):
+    """
+        recording makes r the active recorder, None disables
+    """
+    global recorder
+    previous = recorder
+    recorder = r
+    try:
+        yield r
+    finally:
+        recorder = previous
+
+def timed(name):
+    """
+        timed records the time spent in the decorated function
+        as the phase name
+    """
+    def decorate(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            if recorder is None:
+                return f(*args, **kwargs)
+
+            r = recorder
+            r.enter(name)
+            try:
+                return f(*args, **kwargs)
+            finally:
+                r.exit()
+        return wrapper
+    return decorate
+
+def counted(name, size=lambda result: 1):
+    """
+        counted counts the decorated function's calls under
+        name, each counting size(result)
+    """
+    def decorate(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            result = f(*args, **kwargs)
+            if recorder is not None:
+                recorder.count(name, size(result))
+            return result
+        return wrapper
+    return decorate
+
+def rows(result):
+    """
+        the number of vectors in a stack, e.g. of controls
+    """
+    return int(np.prod(np.shape(result)[:-1]))
+
+def aggregate(results):
+    """
+        aggregate totals the instrumentation of results, over
+        runs and steps
+
+        results of the same batch share their instrumentation,
+        it's counted once
+    """
+    seen = set()
+    total = {"runs": 0, "steps": 0, "phases": {}, "counts": {}}
+    for r in results:
+        s = r.get("instrumentation")
+        if s is None or id(s) in seen:
+            continue
+        seen.add(id(s))
+
+        total["runs"] += s.get("runs", 1)
+        total["steps"] += s["steps"]
+        for (kind, values) in [("phases", s["phases"]), ("counts", s["counts"])]:
+            for name in values:
+                total[kind][name] = total[kind].get(name, 0) + np.sum(values[name])
+    return total
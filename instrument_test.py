@@ -0,0 +1,68 @@
+import numpy as np
+
+import instrument
+import sim
+
+def test_recorder():
+    r = instrument.Recorder()
+
+    @instrument.timed("inner")
+    def inner():
+        return np.zeros((3, 2))
+
+    @instrument.timed("outer")
+    @instrument.counted("rows", size=instrument.rows)
+    def outer():
+        return inner()
+
+    with instrument.recording(r):
+        outer()
+        outer()
+        r.step(1, None, None, None, None)
+    outer()
+
+    s = r.summary()
+    if s["steps"] != 1 or set(s["phases"]) != set(["inner", "outer"]):
+        raise Exception("test_recorder: got " + repr(s))
+    if s["counts"]["rows"][0] != 6:
+        raise Exception("test_recorder: counted " + repr(s["counts"]["rows"]) + " rows, want 6")
+    if instrument.recorder is not None:
+        raise Exception("test_recorder: recorder still active after recording")
+
+def test_run():
+    ics = sim.load("./.test_examples/active=20.json")
+    steps = []
+    hook = lambda r, i, state, log_beliefs, u_h, u_r: steps.append(i)
+
+    want = sim.run(ics)
+    recorder = instrument.Recorder([hook])
+    got = sim.simulate(*sim.configure(ics), recorder=recorder)
+
+    if not np.allclose(got[0], want["trajectory"]):
+        raise Exception("test_run: instrumenting changed the trajectory")
+
+    s = recorder.summary()
+    n = len(want["u_r"])
+    if s["steps"] != n or steps != list(range(1, n + 1)):
+        raise Exception("test_run: recorded " + repr(s["steps"]) + " steps, want " + repr(n))
+
+    cases = [
+        { "in": "phases", "want": ["belief.update", "human", "opt.evaluate", "opt.expected_entropy", "robot"] },
+        { "in": "counts", "want": ["controls", "human_model", "likelihood", "reactions"] },
+    ]
+
+    for case in cases:
+        got = sorted(s[case["in"]])
+        if got != case["want"]:
+            raise Exception("test_run: got " + case["in"] + " " + repr(got) + " want " + repr(case["want"]))
+
+    if not np.all(s["counts"]["controls"] == 100):
+        raise Exception("test_run: expected 100 controls per step, got " + repr(s["counts"]["controls"]))
+
+    r = sim.run(ics, instrumented=True)
+    if r["instrumentation"]["steps"] != n:
+        raise Exception("test_run: result instrumentation has " + repr(r["instrumentation"]["steps"]) + " steps")
+
+if __name__ == '__main__':
+    test_recorder()
+    test_run()
@@ -1,23 +1,198 @@
+import math
+import functools
+
 import numpy as np
 
 import belief
 import geo
+import instrument
+
+# A cost is either:
+#
+#   per-control:  c: (u) -> cost
+#   vectorized:   c: (us) -> costs, us is an (n, 2) matrix of
+#                 controls and costs is the (n,) vector of their costs
+#
+# vectorized costs are marked with the vectorized decorator, every
+# other callable is treated as per-control and evaluated in a loop.
+#
+# The cost builders below also accept a stack of B states (B, 2), with
+# beliefs (B, K), for simulating many runs in lockstep. Their costs then
+# map the (n, 2) controls shared by all runs, or a (B, n, 2) stack of
+# per-run controls, to a (B, n) matrix of costs.
+
+def vectorized(cost):
+    """
+        vectorized marks cost as accepting an (n, 2) matrix
+        of controls and returning the (n,) vector of costs
+
+        use to wrap array-native costs, so argmin can evaluate
+        all the options in one call
+    """
+    cost.vectorized = True
+    return cost
+
+@instrument.counted("controls", size=np.size)
+@instrument.timed("opt.evaluate")
+def evaluate(options, cost):
+    """
+        evaluate computes the cost of every control in options
+
+        use to get the (n,) cost vector, regardless of whether
+        cost is vectorized or per-control
+    """
+    if getattr(cost, "vectorized", False):
+        return np.asarray(cost(np.asarray(options)))
+
+    return np.moveaxis(np.array([cost(op) for op in options]), 0, -1)
 
 def argmin(options, cost):
     """
-        cost should be a function of elements in options
+        cost should be a function of elements in options,
+        or a vectorized cost of the matrix of options
+
+        for a cost over a stack of states, returns the (B, 2)
+        best control of each run
+    """
+    costs = evaluate(options, cost)
+    if costs.ndim <= 1:
+        return options[np.argmin(costs)]
+
+    options = np.asarray(options)
+    best = np.argmin(costs, axis=-1)
+    if options.ndim == costs.ndim + 1:
+        return np.take_along_axis(options, best[..., np.newaxis, np.newaxis], axis=-2)[..., 0, :]
+
+    return options[best]
+
+def primes(k):
+    """
+        the first k primes
+    """
+    found = []
+    p = 2
+    while len(found) < k:
+        if all(p % q for q in found):
+            found.append(p)
+        p += 1
+    return found
+
+def halton(n, dims):
+    """
+        halton is the first n points of the Halton sequence in
+        the unit cube of dims dimensions, (n, dims): a low
+        discrepancy sequence, the radical inverses of 1..n in
+        the first dims prime bases
+    """
+    points = np.empty((n, dims))
+    for (j, p) in enumerate(primes(dims)):
+        i = np.arange(1, n + 1)
+        f = 1.0
+        r = np.zeros(n)
+        while np.any(i > 0):
+            f = f / p
+            r += f * (i % p)
+            i = i // p
+        points[:, j] = r
+    return points
+
+def sphere(n, d):
+    """
+        sphere is n directions spread evenly over the unit sphere
+        in d dimensions, (n, d)
+
+        in 2 dimensions n equi-distant angles, in 3 a Fibonacci
+        lattice, and above the Halton sequence mapped to
+        gaussians (Box-Muller), normalized
+    """
+    if d == 2:
+        angles = np.linspace(0, 2*np.pi, n, endpoint=False)
+        return np.stack([np.cos(angles), np.sin(angles)], axis=1)
+
+    if d == 3:
+        i = np.arange(n) + 0.5
+        z = 1 - 2*i/n
+        r = np.sqrt(1 - z**2)
+        phi = np.pi*(1 + np.sqrt(5))*i
+        return np.stack([r*np.cos(phi), r*np.sin(phi), z], axis=1)
+
+    if d < 2:
+        raise Exception("opt.sphere: need 2 or more dimensions, got " + repr(d))
+
+    u = halton(n, 2*((d + 1)//2))
+    radius = np.sqrt(-2*np.log(u[:, 0::2]))
+    theta = 2*np.pi*u[:, 1::2]
+    g = np.stack([radius*np.cos(theta), radius*np.sin(theta)], axis=-1).reshape(n, -1)[:, :d]
+    return g / geo.norm(g, axis=-1, keepdims=True)
+
+class ControlSet:
+    """
+        ControlSet is a sampled action space, the controls
+        are the rows of one contiguous, read-only (n*m, d)
+        array
+
+        the controls are n directions, at each of m
+        equi-distant magnitudes from alpha down to 0
+        (magnitudes), tier by tier. in 2 dimensions the
+        directions are n equi-distant angles (angles), above
+        they're spread over the sphere, see sphere, and
+        angles is None
+
+        acts as the array of controls, so can be passed to
+        argmin, indexed and iterated over
+    """
+
+    def __init__(self, alpha, n, m=1, endpoint=True, d=2):
+        self.alpha = alpha
+        self.angles = None
+        if d == 2:
+            self.angles = np.linspace(0, 2*np.pi, n, endpoint=endpoint)
+            self.directions = np.stack([np.cos(self.angles), np.sin(self.angles)], axis=1)
+        else:
+            self.directions = sphere(n, d)
+        self.magnitudes = np.linspace(alpha, 0, m)
+        self.controls = np.ascontiguousarray(
+                (self.magnitudes[:, np.newaxis, np.newaxis]*self.directions).reshape(-1, d))
+
+        for a in [self.angles, self.directions, self.magnitudes, self.controls]:
+            if a is not None:
+                a.flags.writeable = False
+
+    def __array__(self, dtype=None, copy=None):
+        if dtype is None:
+            return self.controls
+        return self.controls.astype(dtype)
+
+    def __len__(self):
+        return len(self.controls)
+
+    def __getitem__(self, i):
+        return self.controls[i]
+
+    def __iter__(self):
+        return iter(self.controls)
+
+@functools.lru_cache(maxsize=256)
+def control_set(alpha, n, m=1, endpoint=True, d=2):
+    """
+        control_set is the ControlSet for (alpha, n, m, d),
+        built once and shared by every later call
+
+        use instead of constructing a ControlSet every step
     """
-    return options[np.argmin([cost(op) for op in options])]
+    return ControlSet(alpha, n, m, endpoint, d)
 
-def sample_controls(alpha, n):
+def sample_controls(alpha, n, d=2):
     """
         sample n controls (equi-distant, angularly) on the
         surface of an alpha-ball ||u|| = alpha
+
+        returns an (n, d) matrix, one control per row, shared
+        between calls so read-only, see control_set
     """
-    return [alpha*np.array([np.cos(a), np.sin(a)])
-            for a in np.linspace(0, 2*np.pi, n)]
+    return control_set(alpha, n, d=d).controls
 
-def sample_controls_in_ball(alpha, n, m):
+def sample_controls_in_ball(alpha, n, m, d=2):
     """
         sample controls (equidistant, angularly and in
         magnitude in an alpha-ball ||u|| <= alpha
@@ -25,39 +200,461 @@ def sample_controls_in_ball(alpha, n, m):
         n is the dimension splitting the angle
         m is the dimension splitting magnitude
     """
-    return np.array([
-        control for a in np.linspace(alpha, 0, m) for control in sample_controls(a, n)
-    ])
+    return control_set(alpha, n, m, d=d).controls
+
+def on_circle(alpha, thetas):
+    """
+        the controls of norm alpha at angles thetas, (..., 2)
+    """
+    return alpha*np.stack([np.cos(thetas), np.sin(thetas)], axis=-1)
+
+# A minimizer is a function:
+#   M: (alpha, cost, warm) -> u
+#
+# that picks a control of norm alpha minimizing cost, given the
+# control warm (e.g. past_u_r) as a hint, or None. Like the costs,
+# minimizers handle a stack of states, giving a (B, 2) stack of
+# controls. They plan in d dimensions, 2 by default.
+
+def grid(n, d=2):
+    """
+        grid minimizes by enumerating the n controls of
+        sample_controls, ignoring warm
+    """
+    return lambda alpha, cost, warm=None: argmin(control_set(alpha, n, d=d), cost)
+
+def refine(coarse=16, budget=64, tol=1e-4, d=2):
+    """
+        refine minimizes coarse to fine: it scans coarse angles
+        around the circle, and the angle of warm, then searches
+        around the best, halving the step until it's below tol
+        or budget cost evaluations have been spent
+
+        use for finer than grid precision with fewer cost
+        evaluations, as each evaluation of the step after the
+        scan costs two controls per state
+
+        the search is over angles, so above 2 dimensions refine
+        enumerates budget controls as grid does
+    """
+    def minimize(alpha, cost, warm=None):
+        if d != 2:
+            return argmin(control_set(alpha, budget, d=d), cost)
+
+        scan = control_set(alpha, coarse, endpoint=False)
+        thetas = scan.angles
+        costs = evaluate(scan, cost)
+        best = np.argmin(costs, axis=-1)
+        theta = thetas[best]
+        value = np.min(costs, axis=-1)
+        evals = coarse
+
+        if warm is not None and evals < budget:
+            warm_theta = np.arctan2(warm[..., 1], warm[..., 0])
+            warm_value = evaluate(on_circle(alpha, warm_theta[..., np.newaxis]), cost)[..., 0]
+            theta = np.where(warm_value < value, warm_theta, theta)
+            value = np.minimum(warm_value, value)
+            evals += 1
+
+        step = np.pi/coarse
+        while step > tol and evals + 2 <= budget:
+            candidates = theta[..., np.newaxis] + np.array([-step, step])
+            costs = evaluate(on_circle(alpha, candidates), cost)
+            i = np.argmin(costs, axis=-1)[..., np.newaxis]
+            candidate = np.take_along_axis(candidates, i, axis=-1)[..., 0]
+            candidate_value = np.take_along_axis(costs, i, axis=-1)[..., 0]
+
+            better = candidate_value < value
+            theta = np.where(better, candidate, theta)
+            value = np.where(better, candidate_value, value)
+            step = step / 2
+            evals += 2
+
+        return on_circle(alpha, theta)
+
+    return minimize
+
+def min_expected_q_one(alpha, state, goals, beliefs, starts=4, iters=20, tol=1e-10):
+    """
+        min_expected_q_one is min_expected_q for one state in 2
+        dimensions, as a simulation plans: from the best of the
+        angles towards each goal and starts around the circle,
+        newton steps on the angle, halved until they go
+        downhill, until they move less than tol
+
+        in floats, one goal at a time, as for a handful of goals
+        numpy's overhead per call would dominate
+    """
+    (x, y) = (float(state[0]), float(state[1]))
+    terms = [(float(g[0]) - x, float(g[1]) - y, float(b)) for (g, b) in zip(goals, beliefs) if b > 0]
+
+    def cost(theta):
+        (ux, uy) = (alpha*math.cos(theta), alpha*math.sin(theta))
+        return sum([b*math.hypot(ux - gx, uy - gy) for (gx, gy, b) in terms])
+
+    thetas = [math.atan2(gy, gx) for (gx, gy, b) in terms] + [2*math.pi*i/starts for i in range(starts)]
+    (value, theta) = min([(cost(t), t) for t in thetas])
+
+    for i in range(iters):
+        (ux, uy) = (alpha*math.cos(theta), alpha*math.sin(theta))
+        slope = 0.0
+        curvature = 0.0
+        for (gx, gy, b) in terms:
+            (rx, ry) = (ux - gx, uy - gy)
+            d = max(math.hypot(rx, ry), 1e-12)
+            rt = uy*-rx + ux*ry
+            ru = ux*rx + uy*ry
+            slope += b*rt/d
+            curvature += b*((alpha**2 - ru) - rt*rt/(d*d))/d
+
+        step = -math.copysign(math.pi/8, slope)
+        if curvature > 0:
+            step = max(-math.pi/8, min(math.pi/8, -slope/curvature))
+
+        while alpha*abs(step) >= tol:
+            v = cost(theta + step)
+            if v < value:
+                (theta, value) = (theta + step, v)
+                break
+            step = step/2
+
+        if alpha*abs(step) < tol:
+            break
+
+    return np.array([alpha*math.cos(theta), alpha*math.sin(theta)])
+
+def min_expected_q(alpha, state, goals, beliefs, starts=8, keep=2, iters=20, tol=1e-10):
+    """
+        min_expected_q is the control of norm alpha minimizing
+        expected_q_value(state, goals, beliefs), i.e. the point
+        p = state + u on the circle minimizing the belief
+        weighted sum of distances to the goals
+
+        scans starts angles around the circle, and the angles
+        towards each goal, and iterates on the angle of u from
+        the best keep of them. each iteration takes the better of a newton
+        step and a majorization-minimization (Weiszfeld) step:
+        each distance is bounded by a quadratic, whose sum is
+        minimized over the circle by projecting the weighted
+        mean of the goals onto it. the latter always lowers the
+        cost, the former converges in a few iterations.
+
+        above 2 dimensions, the starts are spread over the
+        sphere and only the majorization-minimization steps
+        are taken, with up to 4*iters iterations
+
+        works over stacks of states, and beliefs; a single 2
+        dimensional state is solved by min_expected_q_one
+    """
+    state = np.asarray(state, dtype=float)
+    goals = np.asarray(goals, dtype=float)
+    if state.shape == (2,) and np.ndim(beliefs) == 1:
+        return min_expected_q_one(alpha, state, goals, beliefs, iters=iters, tol=tol)
+    weights = np.asarray(beliefs, dtype=float)[..., np.newaxis, :]
+    center = state[..., np.newaxis, :]
+    dims = state.shape[-1]
+
+    def offsets(us):
+        # (..., S, K, d) from each goal to state + u
+        return (center + us)[..., np.newaxis, :] - goals
+
+    def costs(us):
+        return np.sum(weights * geo.norm(offsets(us), axis=-1), axis=-1)
+
+    if dims == 2:
+        towards = np.arctan2(goals[:, 1] - state[..., np.newaxis, 1], goals[:, 0] - state[..., np.newaxis, 0])
+        around = np.broadcast_to(control_set(alpha, starts, endpoint=False).angles, towards.shape[:-1] + (starts,))
+        us = on_circle(alpha, np.concatenate([towards, around], axis=-1))
+    else:
+        towards = goals - center
+        towards = alpha*towards/np.maximum(geo.norm(towards, axis=-1, keepdims=True), 1e-12)
+        around = np.broadcast_to(alpha*sphere(starts, dims), towards.shape[:-2] + (starts, dims))
+        us = np.concatenate([towards, around], axis=-2)
+        iters = 4*iters
+    value = costs(us)
+
+    # iterate from the best few starts only
+    kept = np.argsort(value, axis=-1)[..., :keep]
+    us = np.take_along_axis(us, kept[..., np.newaxis], axis=-2)
+    value = np.take_along_axis(value, kept, axis=-1)
+    thetas = np.arctan2(us[..., 1], us[..., 0])
+
+    for i in range(iters):
+        r = offsets(us)
+        d = np.maximum(geo.norm(r, axis=-1), 1e-12)
+        w = weights / d
+
+        # majorization-minimization
+        v = np.sum(w[..., np.newaxis] * goals, axis=-2) / np.sum(w, axis=-1, keepdims=True) - center
+        norms = geo.norm(v, axis=-1, keepdims=True)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mm = np.where(norms > 0, alpha*v/norms, us)
+        mm_value = costs(mm)
+        (candidate, candidate_value) = (mm, mm_value)
+
+        # newton, where the cost is convex in the angle
+        if dims == 2:
+            t = np.stack([-us[..., 1], us[..., 0]], axis=-1)[..., np.newaxis, :]
+            rt = np.sum(r * t, axis=-1)
+            ru = np.sum(r * us[..., np.newaxis, :], axis=-1)
+            slope = np.sum(w * rt, axis=-1)
+            curvature = np.sum(w * ((alpha**2 - ru) - rt**2/d**2), axis=-1)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                step = np.clip(-slope/curvature, -np.pi/8, np.pi/8)
+            newton = on_circle(alpha, thetas + np.where(curvature > 0, step, 0.0))
+
+            newton_value = costs(newton)
+            use_newton = (newton_value <= mm_value)[..., np.newaxis]
+            candidate = np.where(use_newton, newton, mm)
+            candidate_value = np.minimum(newton_value, mm_value)
+
+        # never go uphill, e.g. from rounding at the minimum; once
+        # no kept start moves by tol, they've all converged
+        better = candidate_value < value
+        moved = np.max(np.where(better, geo.norm(candidate - us, axis=-1), 0.0))
+        us = np.where(better[..., np.newaxis], candidate, us)
+        value = np.where(better, candidate_value, value)
+        thetas = np.arctan2(us[..., 1], us[..., 0])
+        if moved < tol:
+            break
+
+    best = np.argmin(value, axis=-1)
+    return np.take_along_axis(us, best[..., np.newaxis, np.newaxis], axis=-2)[..., 0, :]
+
+def exact(fallback=grid(100)):
+    """
+        exact minimizes expected q costs exactly, see
+        min_expected_q, and other costs with fallback
+
+        a cost that includes an expected q term, e.g. active's,
+        is minimized with fallback too, and the term's exact
+        minimum is taken instead where it's better
+    """
+    def minimize(alpha, cost, warm=None):
+        q = getattr(cost, "expected_q", None)
+        if q is not None:
+            return min_expected_q(alpha, *q)
+
+        u = fallback(alpha, cost, warm)
+        term = getattr(getattr(cost, "includes", None), "expected_q", None)
+        if term is None:
+            return u
+
+        return argmin(np.stack([u, min_expected_q(alpha, *term)], axis=-2), cost)
+
+    return minimize
+
+def next_states(state, us):
+    """
+        the state after taking each control
+
+        us is a single control, or a matrix of controls with
+        the candidates along axis -2; returns the (n, 2) next
+        states, or (B, n, 2) for a stack of states
+    """
+    us = np.asarray(us)
+    if us.ndim == 1:
+        return state + us
+
+    return np.asarray(state)[..., np.newaxis, :] + us
+
+def goal_distances(state, goals, us):
+    """
+        the distance to each goal after taking each control
+
+        us is a (n, 2) matrix of controls, goals a (K, 2) matrix;
+        returns the (n, K) matrix of ||state + u - g||, or
+        (B, n, K) for a stack of states
+    """
+    return geo.norm(next_states(state, us)[..., np.newaxis, :] - goals, axis=-1)
+
+def expectation(values, beliefs, us):
+    """
+        the expectation of per-goal values (..., K) under
+        beliefs, with the values computed for controls us
+    """
+    if np.ndim(us) > 1:
+        beliefs = np.asarray(beliefs)[..., np.newaxis, :]
+
+    return np.sum(values * beliefs, axis=-1)
 
 # costs {{{
 
-def expected_entropy(state, goals, beliefs, alpha, likelihood, human_model):
+def expected_entropy(state, goals, log_beliefs, alpha, log_likelihood, human_model):
     """
         generates a function that maps from a control
         to the expected entropy if that particular
         control were to be taken.
 
         use to compute H(b')
+
+        the function is vectorized: for n controls it forms
+        the human's reaction under each of the K goals (n, K, 2),
+        and from those every hypothetical posterior (n, K, K),
+        in one pass. human_model must broadcast and log_likelihood
+        be vectorized, as all of the models in human and belief
+        are. beliefs are log-beliefs, see belief.log_update.
+    """
+    beliefs = np.exp(log_beliefs)
+
+    @vectorized
+    @instrument.timed("opt.expected_entropy")
+    def cost(us):
+        us = np.asarray(us)
+        nexts = next_states(state, us)
+
+        # u_hs[..., j, :] is the reaction if goals[j] were true
+        u_hs = human_model(alpha, nexts[..., np.newaxis, :], goals, us[..., np.newaxis, :])
+
+        # the prior lines up with the (..., n, K) hypotheses
+        prior = np.asarray(log_beliefs)[..., np.newaxis, :]
+        if us.ndim > 1:
+            prior = prior[..., np.newaxis, :]
+
+        # posteriors[..., j, k] is log b'(goals[k]) after seeing u_hs[..., j, :]
+        posteriors = belief.log_update(alpha,
+                        nexts[..., np.newaxis, :], u_hs, us[..., np.newaxis, :],
+                        goals, prior, log_likelihood)
+
+        # the predictions of the last evaluation, see remember
+        cost.last = (us, nexts, u_hs, posteriors)
+
+        return expectation(belief.entropy_from_log(posteriors), beliefs, us)
+
+    cost.last = None
+    cost.predicting = (goals, log_beliefs, log_likelihood)
+    return cost
+
+def remember(memo, cost, u):
+    """
+        remember puts the posteriors the expected_entropy cost
+        predicted for the control u, if it evaluated u last,
+        in memo, a belief.Memo
+
+        use after choosing u, so that if the human reacts as
+        predicted, the next update is a lookup
+    """
+    if memo is None or getattr(cost, "last", None) is None:
+        return
+
+    (us, nexts, u_hs, posteriors) = cost.last
+    (goals, log_beliefs, log_likelihood) = cost.predicting
+    if us.ndim != 2 or np.ndim(log_beliefs) != 1:
+        return
+
+    i = np.flatnonzero(np.all(us == u, axis=-1))
+    if len(i) == 0:
+        return
+
+    i = i[0]
+    for j in range(len(goals)):
+        key = memo.key(log_likelihood, nexts[i], u_hs[i, j], us[i], goals, log_beliefs)
+        if key is not None:
+            memo.put(key, np.array(posteriors[i, j]))
+
+def lookahead(state, goals, log_beliefs, alpha, log_likelihood, human_model, lam,
+        horizon, branch=8, prune=1e-3, quantum=1e-9):
+    """
+        generates a function that maps from a control to its
+        cost planning horizon steps ahead, over the tree of
+        (control, goal hypothesis) branches:
+
+            V_0(s, b) = lam*H(b)
+            Q_h(s, b, u) = E_b[q(s, u, g)] + E_b[V_{h-1}(s + u, b'_g)]
+            V_h(s, b) = min_u' Q_h(s, b, u')
+
+        b'_g is the posterior after the human reacts to u as if
+        g were true. with horizon 1 this is the cost active plans
+        with; deeper levels minimize over the branch controls of
+        control_set(alpha, branch, endpoint=False).
+
+        each level of the tree is evaluated in one batched pass,
+        nodes reached with probability below prune are not
+        expanded, and nodes that coincide (to within quantum)
+        are expanded once. a pruned node with h levels left is
+        valued as a leaf plus h times its best next expected q,
+        so it pays for the rest of the horizon as its expanded
+        siblings do:
+
+            lam*H(b) + h*min_u' E_b[q(s, u')]
     """
-    return lambda u: sum([
-        b * belief.entropy(
-                belief.update(alpha, state + u,
-                       human_model(alpha, state + u, g, u), u,
-                       goals, beliefs, likelihood)
-                )
-        for (g, b) in zip(goals, beliefs)
-    ])
+    deeper = control_set(alpha, branch, endpoint=False, d=np.shape(state)[-1]).controls
+
+    def q_values(states, log_bs, weights, us, h):
+        beliefs = np.exp(log_bs)
+        q = expected_q_value(states, goals, beliefs)(us)
+
+        nexts = next_states(states, us)
+        u_hs = human_model(alpha, nexts[..., np.newaxis, :], goals, us[..., np.newaxis, :])
+        posteriors = belief.log_update(alpha,
+                        nexts[..., np.newaxis, :], u_hs, us[..., np.newaxis, :],
+                        goals, log_bs[:, np.newaxis, np.newaxis, :], log_likelihood)
+
+        # leaf values, replaced below where the tree goes deeper
+        values = lam*belief.entropy_from_log(posteriors)
+
+        if h > 1:
+            reach = (weights[:, np.newaxis] * beliefs)[:, np.newaxis, :] * np.ones(values.shape)
+            expand = reach >= prune
+
+            if np.any(expand):
+                child_states = np.broadcast_to(nexts[..., np.newaxis, :], u_hs.shape)[expand]
+                child_log_bs = posteriors[expand]
+
+                keys = np.round(np.concatenate([child_states, np.maximum(child_log_bs, -1e3)], axis=-1)/quantum)
+                (_, first, inverse) = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+                inverse = inverse.ravel()
+                child_weights = np.zeros(len(first))
+                np.maximum.at(child_weights, inverse, reach[expand])
+
+                child_q = q_values(child_states[first], child_log_bs[first], child_weights, deeper, h - 1)
+                values[expand] = np.min(child_q, axis=-1)[inverse]
+
+            if not np.all(expand):
+                pruned_states = np.broadcast_to(nexts[..., np.newaxis, :], u_hs.shape)[~expand]
+                pruned_q = expected_q_value(pruned_states, goals, np.exp(posteriors[~expand]))(deeper)
+                values[~expand] += (h - 1)*np.min(pruned_q, axis=-1)
+
+        return q + expectation(values, beliefs, us)
+
+    @vectorized
+    @instrument.timed("opt.lookahead")
+    def cost(us):
+        us = np.asarray(us)
+        single_state = np.ndim(state) == 1
+        single_control = us.ndim == 1
+
+        states = np.atleast_2d(state)
+        log_bs = np.atleast_2d(log_beliefs)
+        if single_control:
+            us = us[np.newaxis, :]
+        if single_state and us.ndim > 2:
+            raise Exception("opt.lookahead: per-run controls need a stack of states")
+
+        q = q_values(states, log_bs, np.ones(len(states)), us, horizon)
+
+        if single_state:
+            q = q[0]
+        if single_control:
+            q = q[..., 0]
+        return q
+
+    return cost
 
 def q_value(state, goal):
-    return lambda u: geo.norm(u) + geo.norm(state + u - goal)
+    return vectorized(lambda u: geo.norm(u, axis=-1) + geo.norm(next_states(state, u) - goal, axis=-1))
 
 def expected_q_value(state, goals, beliefs):
     """
         expected q value to trade off between info gain
 
         cost here explicitly for the optimization by
-        enumeration, use for that.
+        enumeration, use for that. the cost carries its
+        expected_q = (state, goals, beliefs), for exact
+        minimization, see exact.
     """
-    return lambda u: (sum([b*q_value(state, g)(u) for (g, b) in zip(goals, beliefs)]))
+    cost = vectorized(lambda u: geo.norm(u, axis=-1) + expectation(goal_distances(state, goals, u), beliefs, u))
+    cost.expected_q = (state, goals, beliefs)
+    return cost
 
 # }}}
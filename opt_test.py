@@ -1,5 +1,9 @@
 import numpy as np
 
+import belief
+import geo
+import human
+import instrument
 import opt
 
 def test_argmin():
@@ -14,6 +18,14 @@ def test_argmin():
         if not (got == want):
             raise Exception("argmin test failure")
 
+def test_argmin_vectorized():
+    us = opt.sample_controls(1, 100)
+    per_control = opt.argmin(list(us), lambda u: -u[0] + 2*u[1])
+    vectorized = opt.argmin(us, opt.vectorized(lambda us: -us[:, 0] + 2*us[:, 1]))
+
+    if not np.allclose(per_control, vectorized):
+        raise Exception("test_argmin_vectorized: got " + repr(vectorized) + " want " + repr(per_control))
+
 def test_sample_controls():
     cases = [
         {
@@ -75,9 +87,275 @@ def test_expected_q_value():
         if not np.allclose(got, want):
             raise Exception("test_expected_q_value: got " + repr(got) + " want " + repr(want))
 
+def test_goal_distances():
+    state = np.array([0, .5])
+    goals = np.array([[1, 1], [1, 0]])
+    us = opt.sample_controls(.1, 10)
+
+    got = opt.goal_distances(state, goals, us)
+    want = np.array([[geo.norm(state + u - g) for g in goals] for u in us])
+
+    if not (got.shape == (10, 2) and np.allclose(got, want)):
+        raise Exception("test_goal_distances: got " + repr(got) + " want " + repr(want))
+
+def test_expected_q_value_vectorized():
+    state = np.array([0, .5])
+    goals = np.array([[1, 1], [1, 0]])
+    beliefs = np.array([0.3, 0.7])
+    us = opt.sample_controls(.1, 100)
+
+    cost = opt.expected_q_value(state, goals, beliefs)
+    got = opt.evaluate(us, cost)
+    want = np.array([cost(u) for u in us])
+
+    if not np.allclose(got, want):
+        raise Exception("test_expected_q_value_vectorized: got " + repr(got) + " want " + repr(want))
+
+def test_expected_entropy():
+    state = np.array([0, .5])
+    goals = np.array([[1, 1], [1, 0]])
+    beliefs = np.array([0.3, 0.7])
+    alpha = .1
+    us = opt.sample_controls(alpha, 20)
+
+    cases = [
+        (belief.log_boltzmann(2.0), human.optimal),
+        (belief.log_lazy(np.pi/4), human.lazy(np.pi/4)),
+    ]
+
+    for (log_likelihood, human_model) in cases:
+        got = opt.expected_entropy(state, goals, np.log(beliefs), alpha, log_likelihood, human_model)(us)
+        likelihood = belief.exponentiated(log_likelihood)
+        want = np.array([
+            sum([b * belief.entropy(
+                    belief.update(alpha, state + u,
+                        human_model(alpha, state + u, g, u), u,
+                        goals, beliefs, likelihood))
+                for (g, b) in zip(goals, beliefs)])
+            for u in us
+        ])
+
+        if not (got.shape == (20,) and np.allclose(got, want)):
+            raise Exception("test_expected_entropy: got " + repr(got) + " want " + repr(want))
+
+def test_refine():
+    goals = np.array([[1, 1], [1, 0]])
+    states = np.array([[0, .5], [.3, .6], [.5, .2]])
+    log_beliefs = np.log(np.array([[.3, .7], [.5, .5], [.9, .1]]))
+    alpha = .1
+
+    for (state, log_b) in zip(states, log_beliefs):
+        costs = [
+            opt.expected_q_value(state, goals, np.exp(log_b)),
+            opt.expected_entropy(state, goals, log_b, alpha, belief.log_boltzmann(2.0), human.optimal),
+        ]
+        for cost in costs:
+            evaluated = [0]
+            @opt.vectorized
+            def counted(us):
+                evaluated[0] += len(us)
+                return cost(us)
+
+            got = opt.refine(budget=64)(alpha, counted, np.array([alpha, 0]))
+            want = opt.grid(100)(alpha, cost)
+
+            if not (np.isclose(geo.norm(got), alpha) and cost(got) <= cost(want) + 1e-12):
+                raise Exception("test_refine: got " + repr(got) + " want at least as good as " + repr(want))
+
+            if evaluated[0] > 64:
+                raise Exception("test_refine: spent " + repr(evaluated[0]) + " evaluations, budget 64")
+
+    # a stack of states refines each independently
+    cost = opt.expected_entropy(states, goals, log_beliefs, alpha, belief.log_boltzmann(2.0), human.optimal)
+    got = opt.refine()(alpha, cost, np.zeros(states.shape))
+    want = [opt.refine()(alpha,
+                opt.expected_entropy(s, goals, log_b, alpha, belief.log_boltzmann(2.0), human.optimal),
+                np.zeros(2))
+            for (s, log_b) in zip(states, log_beliefs)]
+
+    if not np.allclose(got, want):
+        raise Exception("test_refine: stacked: got " + repr(got) + " want " + repr(want))
+
+def test_control_set():
+    cs = opt.control_set(.1, 10, 3)
+
+    if opt.control_set(.1, 10, 3) is not cs:
+        raise Exception("test_control_set: control_set isn't memoized")
+
+    want = np.array([a*np.array([np.cos(t), np.sin(t)])
+                        for a in np.linspace(.1, 0, 3)
+                        for t in np.linspace(0, 2*np.pi, 10)])
+    if not (np.asarray(cs).shape == (30, 2) and np.allclose(cs, want)):
+        raise Exception("test_control_set: got " + repr(np.asarray(cs)) + " want " + repr(want))
+
+    if not np.allclose(cs.directions*.1, opt.sample_controls(.1, 10)):
+        raise Exception("test_control_set: directions don't match sample_controls")
+
+    # argmin takes the set directly
+    got = opt.argmin(cs, opt.q_value(np.array([0, 0]), np.array([1, 0])))
+    if not np.allclose(got, [.1, 0]):
+        raise Exception("test_control_set: argmin got " + repr(got) + " want [.1, 0]")
+
+def test_sphere():
+    rng = np.random.default_rng(111)
+    for d in [2, 3, 4, 6]:
+        points = opt.sphere(500, d)
+        if not (points.shape == (500, d) and np.allclose(geo.norm(points, axis=-1), 1)):
+            raise Exception("test_sphere: " + repr(d) + ": not 500 unit directions")
+
+        # spread: no two points coincide, and every direction is
+        # about as close to a point as for random points, or closer
+        cosines = points @ points.T
+        np.fill_diagonal(cosines, -1)
+        probes = rng.normal(size=(2000, d))
+        probes /= geo.norm(probes, axis=-1, keepdims=True)
+        random = rng.normal(size=(500, d))
+        random /= geo.norm(random, axis=-1, keepdims=True)
+
+        gap = np.max(np.arccos(np.clip(np.max(probes @ points.T, axis=-1), -1, 1)))
+        random_gap = np.max(np.arccos(np.clip(np.max(probes @ random.T, axis=-1), -1, 1)))
+        if not (np.max(cosines) < 1 - 1e-9 and gap <= 1.1*random_gap):
+            raise Exception("test_sphere: " + repr(d) + ": largest gap " + repr(gap) + ", random " + repr(random_gap))
+
+    cs = opt.control_set(.1, 50, 2, d=3)
+    if not (cs.angles is None and np.asarray(cs).shape == (100, 3) and np.allclose(geo.norm(cs[:50], axis=-1), .1)):
+        raise Exception("test_sphere: got the control set " + repr(np.asarray(cs)))
+
+def test_lookahead():
+    goals = np.array([[1, 1], [1, 0]])
+    states = np.array([[0, .5], [.3, .6]])
+    log_beliefs = np.log(np.array([[.3, .7], [.5, .5]]))
+    log_likelihood = belief.log_boltzmann(2.0)
+    alpha = .1
+    lam = 50
+    us = opt.sample_controls(alpha, 100)
+
+    (state, log_b) = (states[0], log_beliefs[0])
+    active = (opt.expected_q_value(state, goals, np.exp(log_b))(us)
+                + lam*opt.expected_entropy(state, goals, log_b, alpha, log_likelihood, human.optimal)(us))
+
+    # one step ahead is what active plans with
+    got = opt.lookahead(state, goals, log_b, alpha, log_likelihood, human.optimal, lam, 1)(us)
+    if not np.allclose(got, active):
+        raise Exception("test_lookahead: horizon 1: got " + repr(got) + " want " + repr(active))
+
+    # a stack of states plans each independently
+    got = opt.lookahead(states, goals, log_beliefs, alpha, log_likelihood, human.optimal, lam, 2)(us)
+    want = [opt.lookahead(s, goals, log_b, alpha, log_likelihood, human.optimal, lam, 2)(us)
+            for (s, log_b) in zip(states, log_beliefs)]
+    if not (got.shape == (2, 100) and np.allclose(got, want)):
+        raise Exception("test_lookahead: stacked: got " + repr(got) + " want " + repr(want))
+
+    # the recursion, evaluated naively: every branch, path by
+    # path, none merged; a branch reached with probability below
+    # prune is valued as a leaf plus the q of the steps left
+    branch = 4
+    deeper = opt.control_set(alpha, branch, endpoint=False).controls
+
+    def naive(s, log_b, u, h, human_model, prune=0.0, reach=1.0):
+        b = np.exp(log_b)
+        value = opt.expected_q_value(s, goals, b)(u)
+        for (j, g) in enumerate(goals):
+            u_h = human_model(alpha, s + u, g, u)
+            posterior = belief.log_update(alpha, s + u, u_h, u, goals, log_b, log_likelihood)
+            v = lam*belief.entropy_from_log(posterior)
+            if h > 1 and reach*b[j] < prune:
+                v += (h - 1)*min([opt.expected_q_value(s + u, goals, np.exp(posterior))(child) for child in deeper])
+            elif h > 1:
+                v = min([naive(s + u, posterior, child, h - 1, human_model, prune, reach*b[j]) for child in deeper])
+            value += b[j]*v
+        return value
+
+    def reactions(human_model, prune):
+        r = instrument.Recorder()
+        counted = instrument.counted("reactions", size=instrument.rows)(human_model)
+        with instrument.recording(r):
+            got = opt.lookahead(state, goals, log_b, alpha, log_likelihood, counted, lam, 2, branch, prune)(few)
+            r.step(1, None, None, None, None)
+        return (got, r.summary()["counts"]["reactions"][0])
+
+    few = opt.control_set(alpha, 6, endpoint=False).controls
+    # the reactions every branch would take: the n controls'
+    # under each goal, and each of their children's
+    every = len(few)*len(goals) + len(few)*len(goals)*branch*len(goals)
+
+    # a human heading for goal 0 whatever the goal, so the
+    # children of each control coincide and are merged
+    blind = lambda alpha, s, g, u_r: human.optimal(alpha, s, np.broadcast_to(goals[0], np.shape(g)), u_r)
+
+    for (name, human_model, prune) in [("optimal", human.optimal, 0.0), ("blind", blind, 0.0), ("pruned", human.optimal, .5)]:
+        (got, counted) = reactions(human_model, prune)
+        want = [naive(state, log_b, u, 2, human_model, prune) for u in few]
+        if not np.allclose(got, want):
+            raise Exception("test_lookahead: " + name + ": got " + repr(got) + " want " + repr(want))
+
+        # the goal blind human's children and, with beliefs
+        # (.3, .7), the children reached by .3 under prune .5
+        # are expanded once or not at all
+        if counted != (every if name == "optimal" else len(few)*len(goals)*(1 + branch)):
+            raise Exception("test_lookahead: " + name + ": took " + repr(counted) + " reactions of " + repr(every))
+
+    # pruned nodes pay the q of the rest of the horizon as their
+    # expanded siblings do, at any depth; pruning every branch
+    # adds it to active's cost
+    for (horizon, prune) in [(3, 0.0), (3, .25), (3, .5), (3, 2.0)]:
+        got = opt.lookahead(state, goals, log_b, alpha, log_likelihood, human.optimal, lam, horizon, branch, prune)(few)
+        want = [naive(state, log_b, u, horizon, human.optimal, prune) for u in few]
+        if not np.allclose(got, want):
+            raise Exception("test_lookahead: horizon " + repr(horizon) + ", prune " + repr(prune) + ": got " + repr(got) + " want " + repr(want))
+
+def test_exact():
+    goals = np.array([[1, 1], [1, 0], [0, 1]])
+    states = np.array([[0, .5], [.3, .6], [.9, .1], [.95, .95]])
+    beliefs = np.array([[.3, .6, .1], [.5, .5, 0], [.9, .05, .05], [.2, .2, .6]])
+    alpha = .1
+
+    for (state, b) in zip(states, beliefs):
+        cost = opt.expected_q_value(state, goals, b)
+        got = opt.exact()(alpha, cost)
+        fine = opt.grid(100000)(alpha, cost)
+
+        if not (np.isclose(geo.norm(got), alpha) and cost(got) <= cost(opt.grid(100)(alpha, cost)) + 1e-12
+                and np.isclose(cost(got), cost(fine))):
+            raise Exception("test_exact: got " + repr(got) + " want " + repr(fine))
+
+    # a stack of states is solved per state
+    got = opt.exact()(alpha, opt.expected_q_value(states, goals, beliefs))
+    want = [opt.exact()(alpha, opt.expected_q_value(s, goals, b)) for (s, b) in zip(states, beliefs)]
+    if not np.allclose(got, want):
+        raise Exception("test_exact: stacked: got " + repr(got) + " want " + repr(want))
+
+    # other costs fall back, and costs including an expected q take its minimum where better
+    eq = opt.expected_q_value(states[0], goals, beliefs[0])
+    ee = opt.expected_entropy(states[0], goals, np.log(beliefs[0]), alpha, belief.log_boltzmann(2.0), human.optimal)
+    cost = opt.vectorized(lambda us: eq(us) + 1e-3*ee(us))
+    cost.includes = eq
+
+    if not np.allclose(opt.exact()(alpha, ee), opt.grid(100)(alpha, ee)):
+        raise Exception("test_exact: expected the grid's minimum of a cost without an expected q")
+    if not cost(opt.exact()(alpha, cost)) < cost(opt.grid(100)(alpha, cost)):
+        raise Exception("test_exact: expected the exact expected q minimum to beat the grid")
+
+    # in 3 dimensions, the exact minimum beats a fine grid
+    goals = np.array([[1, 1, 0], [1, 0, 1], [0, 1, 1]])
+    for (state, b) in zip(np.array([[0, .5, .2], [.9, .1, .8]]), beliefs):
+        cost = opt.expected_q_value(state, goals, b)
+        got = opt.exact(opt.grid(100, 3))(alpha, cost)
+        fine = opt.grid(20000, 3)(alpha, cost)
+        if not (np.isclose(geo.norm(got), alpha) and cost(got) <= cost(fine) + 1e-12):
+            raise Exception("test_exact: 3d: got " + repr(got) + " want " + repr(fine))
 
 if __name__ == '__main__':
     test_argmin()
+    test_argmin_vectorized()
     test_sample_controls()
     test_q_value()
     test_expected_q_value()
+    test_goal_distances()
+    test_expected_q_value_vectorized()
+    test_expected_entropy()
+    test_refine()
+    test_control_set()
+    test_sphere()
+    test_lookahead()
+    test_exact()
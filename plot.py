@@ -40,7 +40,8 @@ def vis(a, result, **vargs):
 def visualize(a, start, goals, trajectories=None, u_hs=None, c = "r", true_goal=0):
     """
         plots the start and goals and trajectory if provided
-        on a 2D canvas
+        on a 2D canvas, projecting points in more dimensions
+        onto their first two
 
         use to visualize the results of simulate
     """
@@ -71,13 +72,18 @@ def visualize(a, start, goals, trajectories=None, u_hs=None, c = "r", true_goal=
                     a.arrow(t[i][0], t[i][1], u_h[i][0], u_h[i][1], fc="k", alpha=1.0/len(u_hs))
 
 
-def plot_beliefs(a, beliefs, labels=None):
+def plot_beliefs(a, beliefs, labels=None, steps=None):
     """
         plot beliefs over time, use to visualize
         beliefs returned by simulate
 
         labels are "Goal i" if they aren't provided
+
+        steps are the step of each belief, see sim.belief_steps,
+        by default one per step
     """
+    if steps is None:
+        steps = np.arange(len(beliefs))
     slick(a)
     a.set_ylim([0, 1.05])
     for i in range(beliefs.shape[1]):
@@ -86,10 +92,35 @@ def plot_beliefs(a, beliefs, labels=None):
         else:
             label = labels[i]
 
-        a.plot(beliefs[:,i], label=label)
+        a.plot(steps, beliefs[:,i], label=label)
     a.legend(prop=palatino)
 
-def compare_beliefs(a, belief_sets, goal=0, labels=None, colors=None, legend=True, multi=False, fontsize=20):
+def by_step(beliefs, steps):
+    """
+        the steps any of the runs' beliefs were recorded at, and
+        the mean and standard error of the beliefs at each, the
+        beliefs of run i being at steps[i], see sim.belief_steps
+    """
+    at = {}
+    for (b, s) in zip(beliefs, steps):
+        for (v, step) in zip(b, s):
+            at.setdefault(int(step), []).append(v)
+
+    xs = sorted(at)
+    return (np.array(xs),
+            np.array([np.mean(at[x]) for x in xs]),
+            np.array([np.std(at[x])/np.sqrt(len(at[x])) for x in xs]))
+
+def compare_beliefs(a, belief_sets, goal=0, labels=None, colors=None, legend=True, multi=False, fontsize=20, steps=None):
+    """
+        plot the belief in goal of each of belief_sets, or with
+        multi, the mean of each set of runs' beliefs
+
+        steps, if given, are the steps of the beliefs, as
+        belief_sets but of sim.belief_steps, so runs keeping
+        fewer beliefs are lined up by step; by default each
+        belief is a step
+    """
     print("warning setting global palatino font size")
     # TODO: fix
     palatino.set_size(fontsize)
@@ -113,7 +144,10 @@ def compare_beliefs(a, belief_sets, goal=0, labels=None, colors=None, legend=Tru
         if colors is not None and labels is not None:
             patches.append(mpatches.Patch(color=c, label=label))
 
-        if multi:
+        if multi and steps is not None:
+            (xs, means, errors) = by_step([b[:, goal] for b in belief_sets[i]], steps[i])
+            a.errorbar(xs, means, yerr=errors, label=label, c=c)
+        elif multi:
             data = [b[:, goal] for b in belief_sets[i]]
 
             l = np.min([len(b) for b in belief_sets[i]])
@@ -124,6 +158,8 @@ def compare_beliefs(a, belief_sets, goal=0, labels=None, colors=None, legend=Tru
                     duo.mean(data),
                     yerr=np.std(data_trunc)/np.sqrt(len(data)),
                     label=label, c=c)
+        elif steps is not None:
+            a.plot(steps[i], belief_sets[i][:,goal], label=label, c=c, linewidth=2.0)
         else:
             a.plot(belief_sets[i][:,goal], label=label, c=c, linewidth=2.0)
     if legend:
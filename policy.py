@@ -0,0 +1,180 @@
+import json
+import argparse
+
+import numpy as np
+
+import geo
+import sim
+
+# A compiled policy is a robot's plan, precomputed over a grid of
+# states and beliefs, for one goal layout and set of parameters:
+# with two goals the beliefs are a single number, the belief in
+# the first goal. At runtime the control is interpolated from the
+# table, see interpolator and robot.compiled.
+#
+#   python policy.py .test_examples/active=20.json active.npz -j 8
+#
+# and run with "robot": "compiled", "robot_params": {"policy": "active.npz"}
+
+FORMAT = "duo-policy-1"
+
+def bounds_for(ics, margin=0.25):
+    """
+        bounds_for is the (lo, hi) corners of the box around the
+        start and the goals, grown by margin
+    """
+    points = np.vstack([np.asarray(ics["goals"], dtype=float), np.asarray(ics["start"], dtype=float)])
+    return (np.min(points, axis=0) - margin, np.max(points, axis=0) + margin)
+
+def plan_chunk(task):
+    """
+        plan_chunk plans a chunk of the grid, with the robot of
+        the conditions
+
+        a task is (ics, alpha, states, log_beliefs)
+    """
+    (ics, alpha, states, log_beliefs) = task
+    (start, goals, true_goal, human, robot, prior) = sim.configure(ics)
+    if not hasattr(robot, "plan"):
+        raise Exception("policy.compile: robot " + repr(ics["robot"]) + " doesn't plan")
+
+    return robot.plan(alpha, states, goals, log_beliefs, None)
+
+def compile(ics, shape=(41, 41, 21), bounds=None, alpha=0.1, workers=None, chunk=256):
+    """
+        compile tabulates the control the robot of the initial
+        conditions plans, over a shape = (nx, ny, nb) grid of
+        states in bounds (see bounds_for) and beliefs in the
+        first of the two goals
+
+        the grid is planned in batches of chunk states, on a
+        pool of workers processes, by default one per cpu
+
+        returns the table, see save
+    """
+    goals = np.asarray(ics["goals"], dtype=float)
+    if len(goals) != 2:
+        raise Exception("policy.compile: compiled policies need two goals, got " + repr(len(goals)))
+    if goals.shape[-1] != 2:
+        raise Exception("policy.compile: compiled policies are over 2 dimensional states, got " + repr(goals.shape[-1]))
+
+    if bounds is None:
+        bounds = bounds_for(ics)
+    (lo, hi) = bounds
+    (nx, ny, nb) = shape
+
+    xs = np.linspace(lo[0], hi[0], nx)
+    ys = np.linspace(lo[1], hi[1], ny)
+    bs = np.linspace(0.0, 1.0, nb)
+
+    (x, y, b) = np.meshgrid(xs, ys, bs, indexing="ij")
+    states = np.stack([x.ravel(), y.ravel()], axis=-1)
+    b = np.clip(b.ravel(), 1e-9, 1 - 1e-9)
+    log_beliefs = np.log(np.stack([b, 1 - b], axis=-1))
+
+    tasks = [(ics, alpha, states[i:i + chunk], log_beliefs[i:i + chunk]) for i in range(0, len(states), chunk)]
+
+    if workers == 1:
+        controls = [plan_chunk(t) for t in tasks]
+    else:
+        import multiprocessing
+
+        with multiprocessing.Pool(workers) as pool:
+            controls = pool.map(plan_chunk, tasks)
+
+    return {
+        "controls": np.concatenate(controls).reshape((nx, ny, nb, 2)).astype(np.float32),
+        "xs": xs,
+        "ys": ys,
+        "bs": bs,
+        "goals": goals,
+        "alpha": alpha,
+        "conditions": ics,
+    }
+
+def save(path, table):
+    """
+        save writes a table as an .npz array file, the controls
+        as float32
+    """
+    np.savez(path,
+            format=np.array(FORMAT),
+            controls=np.asarray(table["controls"], dtype=np.float32),
+            xs=table["xs"], ys=table["ys"], bs=table["bs"],
+            goals=table["goals"],
+            alpha=np.array(table["alpha"]),
+            conditions=np.array(json.dumps(table["conditions"])))
+
+def load(path):
+    with np.load(path) as f:
+        if "format" not in f or str(f["format"]) != FORMAT:
+            raise Exception("policy.load: " + repr(path) + " is not a " + FORMAT + " file")
+
+        return {
+            "controls": f["controls"],
+            "xs": f["xs"],
+            "ys": f["ys"],
+            "bs": f["bs"],
+            "goals": f["goals"],
+            "alpha": float(f["alpha"]),
+            "conditions": json.loads(str(f["conditions"])),
+        }
+
+def cell(grid, v):
+    """
+        the index of the cell of the evenly spaced grid holding
+        v, and v's fraction of the way across it; v outside the
+        grid is clamped to its edge
+    """
+    t = (np.asarray(v, dtype=float) - grid[0]) / (grid[1] - grid[0])
+    i = np.clip(np.floor(t), 0, len(grid) - 2).astype(int)
+    return (i, np.clip(t - i, 0.0, 1.0))
+
+def interpolator(table):
+    """
+        interpolator is the lookup of a table:
+
+            (alpha, state, goals, beliefs) -> control
+
+        trilinear in the state and the belief in the first
+        goal, renormalized to norm alpha; state and beliefs may
+        be stacks
+    """
+    controls = np.asarray(table["controls"], dtype=float)
+    (xs, ys, bs) = (table["xs"], table["ys"], table["bs"])
+    goals = table["goals"]
+
+    def lookup(alpha, state, goals_now, beliefs):
+        if not np.array_equal(goals_now, goals):
+            raise Exception("policy.lookup: the policy was compiled for goals " + repr(goals.tolist()))
+
+        state = np.asarray(state)
+        (i, fx) = cell(xs, state[..., 0])
+        (j, fy) = cell(ys, state[..., 1])
+        (k, fb) = cell(bs, np.asarray(beliefs)[..., 0])
+
+        u = 0.0
+        for (di, wx) in [(0, 1 - fx), (1, fx)]:
+            for (dj, wy) in [(0, 1 - fy), (1, fy)]:
+                for (dk, wb) in [(0, 1 - fb), (1, fb)]:
+                    u = u + (wx*wy*wb)[..., np.newaxis] * controls[i + di, j + dj, k + dk]
+
+        norms = geo.norm(u, axis=-1, keepdims=True)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(norms > 0, alpha*u/norms, 0.0)
+
+    return lookup
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="compile a robot's policy into a lookup table")
+    parser.add_argument("conditions", help="initial conditions json file, e.g. .test_examples/active=20.json")
+    parser.add_argument("out", help="the .npz file to write")
+    parser.add_argument("--shape", type=int, nargs=3, default=[41, 41, 21], metavar=("NX", "NY", "NB"),
+            help="grid points in x, y and the belief in the first goal (default 41 41 21)")
+    parser.add_argument("--alpha", type=float, default=0.1,
+            help="the norm of the controls (default 0.1)")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+            help="plan on a pool of this many processes (default one per cpu)")
+    args = parser.parse_args()
+
+    save(args.out, compile(sim.load(args.conditions), tuple(args.shape), alpha=args.alpha, workers=args.workers))
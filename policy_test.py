@@ -0,0 +1,57 @@
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+import geo
+import policy
+import sim
+
+def test_compile():
+    ics = sim.load("./.test_examples/active=20.json")
+    table = policy.compile(ics, (5, 4, 3), workers=1, chunk=7)
+    (start, goals, true_goal, human, robot, prior) = sim.configure(ics)
+    lookup = policy.interpolator(table)
+
+    # on the grid, the lookup is the plan
+    for (i, j, k) in [(0, 0, 0), (2, 3, 1), (4, 1, 2)]:
+        state = np.array([table["xs"][i], table["ys"][j]])
+        b = np.clip(table["bs"][k], 1e-9, 1 - 1e-9)
+        want = robot.plan(.1, state, goals, np.log([b, 1 - b]))
+        got = lookup(.1, state, goals, np.array([b, 1 - b]))
+
+        if not (np.isclose(geo.norm(got), .1) and np.allclose(got, want, atol=1e-6)):
+            raise Exception("test_compile: got " + repr(got) + " want " + repr(want))
+
+    # stacks of states look up each
+    states = np.array([[0, .5], [.3, .6], [2, -2]])
+    beliefs = np.array([[.5, .5], [.9, .1], [.2, .8]])
+    got = lookup(.1, states, goals, beliefs)
+    want = [lookup(.1, s, goals, b) for (s, b) in zip(states, beliefs)]
+    if not np.allclose(got, want):
+        raise Exception("test_compile: stacked: got " + repr(got) + " want " + repr(want))
+
+def test_run():
+    path = tempfile.mkdtemp()
+    try:
+        ics = sim.load("./.test_examples/active=20.json")
+        filename = os.path.join(path, "active.npz")
+        policy.save(filename, policy.compile(ics, (21, 21, 11), workers=2))
+
+        loaded = policy.load(filename)
+        if not (loaded["controls"].dtype == np.float32 and loaded["conditions"] == ics):
+            raise Exception("test_run: load didn't round trip")
+
+        want = sim.run(ics)
+        got = sim.run(dict(ics, robot="compiled", robot_params={"policy": filename}))
+        if not geo.norm(got["trajectory"][-1] - np.asarray(ics["goals"][ics["true_goal"]])) <= .1:
+            raise Exception("test_run: the compiled robot didn't reach the goal")
+        if abs(len(got["u_r"]) - len(want["u_r"])) > 2:
+            raise Exception("test_run: took " + repr(len(got["u_r"])) + " steps, planning took " + repr(len(want["u_r"])))
+    finally:
+        shutil.rmtree(path)
+
+if __name__ == '__main__':
+    test_compile()
+    test_run()
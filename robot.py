@@ -1,82 +1,159 @@
 import numpy as np
 
 import opt
-import geo
 import belief
 
 # A robot is a function
-#   R: (alpha, state, goals, beliefs, past_u_r, u_h) -> (action, new_beliefs)
+#   R: (alpha, state, goals, log_beliefs, past_u_r, u_h) -> (action, new_log_beliefs)
+#
+# beliefs are carried in log-space, see belief.log_update
 
 # four main robot controllers:
 #   1. teleop (no inference, copy human)
 #   2. shared (inference, expecation planning)
 #   3. info   (inference, entropy planning)
 #   4. active (inference, expecation + lam*entropy planning)
-
-def teleop(alpha, state, goals, beliefs, past_u_r, u_h):
+#
+# and active_horizon, active planning several steps ahead,
+# and compiled, looking up a precompiled policy
+#
+# the planning robots expose their plan, the control they'd take
+# given the updated beliefs, as controller.plan:
+#   P: (alpha, state, goals, log_beliefs, past_u_r) -> (action)
+#
+# the cost the plan minimizes as controller.objective:
+#   O: (alpha, state, goals, log_beliefs) -> (cost)
+#
+# and their controller.log_likelihood
+
+def teleop(alpha, state, goals, log_beliefs, past_u_r, u_h):
     """
         teleop follows u_h exactly.
     """
-    return (u_h, beliefs)
+    return (u_h, log_beliefs)
 
-def shared_sampled(likelihood, human_model):
-    def controller(alpha, state, goals, beliefs, past_u_r, u_h):
+def shared_sampled(log_likelihood, human_model, minimize=opt.grid(100)):
+    """
+        minimize is the opt minimizer used to plan, e.g.
+        opt.refine() instead of the default 100 point grid
+    """
+    def objective(alpha, state, goals, log_beliefs):
         """
             shared plans in expectation with respect
             to current beliefs.
         """
-        new_beliefs = belief.update(alpha, state, u_h, past_u_r, goals, beliefs, likelihood)
+        return opt.expected_q_value(state, goals, np.exp(log_beliefs))
 
-        u_R = opt.argmin(
-                opt.sample_controls(alpha, 100),
-                opt.expected_q_value(state, goals, new_beliefs),
-              )
+    def plan(alpha, state, goals, log_beliefs, past_u_r=None):
+        return minimize(alpha, objective(alpha, state, goals, log_beliefs), past_u_r)
 
-        return (u_R, new_beliefs)
+    def controller(alpha, state, goals, log_beliefs, past_u_r, u_h):
+        new_log_beliefs = belief.log_update(alpha, state, u_h, past_u_r, goals, log_beliefs, log_likelihood)
+        return (plan(alpha, state, goals, new_log_beliefs, past_u_r), new_log_beliefs)
 
+    controller.objective = objective
+    controller.plan = plan
+    controller.log_likelihood = log_likelihood
     return controller
 
-def info(likelihood, human_model):
+def info(log_likelihood, human_model, minimize=opt.grid(100), memo=None):
     """
         info takes actions which minimize H(b')
-    """
-
-    def controller(alpha, state, goals, beliefs, past_u_r, u_h):
-        new_beliefs = belief.update(alpha, state, u_h, past_u_r, goals, beliefs, likelihood)
-
-        u_R = opt.argmin(
-                opt.sample_controls(alpha, 100),
-                opt.expected_entropy(state, goals, new_beliefs, alpha)
-              )
-
-        return (u_R, new_beliefs)
 
+        memo is an optional belief.Memo of posteriors, see
+        opt.remember
+    """
+    def objective(alpha, state, goals, log_beliefs):
+        return opt.expected_entropy(state, goals, log_beliefs, alpha, log_likelihood, human_model)
+
+    def plan(alpha, state, goals, log_beliefs, past_u_r=None):
+        ee = objective(alpha, state, goals, log_beliefs)
+        u_R = minimize(alpha, ee, past_u_r)
+        opt.remember(memo, ee, u_R)
+        return u_R
+
+    def controller(alpha, state, goals, log_beliefs, past_u_r, u_h):
+        new_log_beliefs = belief.log_update(alpha, state, u_h, past_u_r, goals, log_beliefs, log_likelihood, memo)
+        return (plan(alpha, state, goals, new_log_beliefs, past_u_r), new_log_beliefs)
+
+    controller.objective = objective
+    controller.plan = plan
+    controller.log_likelihood = log_likelihood
+    controller.memo = memo
     return controller
 
-def active(likelihood, human_model, lam):
+def active(log_likelihood, human_model, lam, minimize=opt.grid(100), memo=None):
     """
         active curries the true active function
         with the likelihood and lam hyperparamter
+
+        memo is as for info
     """
-    def controller(alpha, state, goals, beliefs, past_u_r, u_h):
+    def objective(alpha, state, goals, log_beliefs):
         """
             active uses lam hyperparamter to trade off
             between shared shared autonomy expectation
             planning and entropy minimization
         """
-        new_beliefs = belief.update(alpha, state, u_h, past_u_r, goals, beliefs, likelihood)
+        eq = opt.expected_q_value(state, goals, np.exp(log_beliefs))
+        ee = opt.expected_entropy(state, goals, log_beliefs, alpha, log_likelihood, human_model)
+
+        @opt.vectorized
+        def cost(us):
+            return eq(us) + lam*ee(us)
+        cost.includes = eq
+        cost.entropy = ee
+        return cost
+
+    def plan(alpha, state, goals, log_beliefs, past_u_r=None):
+        cost = objective(alpha, state, goals, log_beliefs)
+        u_R = minimize(alpha, cost, past_u_r)
+        opt.remember(memo, cost.entropy, u_R)
+        return u_R
+
+    def controller(alpha, state, goals, log_beliefs, past_u_r, u_h):
+        new_log_beliefs = belief.log_update(alpha, state, u_h, past_u_r, goals, log_beliefs, log_likelihood, memo)
+        return (plan(alpha, state, goals, new_log_beliefs, past_u_r), new_log_beliefs)
+
+    controller.objective = objective
+    controller.plan = plan
+    controller.log_likelihood = log_likelihood
+    controller.memo = memo
+    return controller
 
-        ee = opt.expected_entropy(state, goals, new_beliefs, alpha, likelihood, human_model)
-        def cost(u):
-            return (sum([b*(geo.norm(u) + geo.norm(state + u - g))
-                        for (g, b) in zip(goals, new_beliefs)])
-                        + lam*ee(u))
+def active_horizon(log_likelihood, human_model, lam, horizon,
+        minimize=opt.grid(100), branch=8, prune=1e-3):
+    """
+        active_horizon is active, looking horizon steps ahead
+        over the tree of controls and human reactions, see
+        opt.lookahead for branch and prune
+    """
+    def objective(alpha, state, goals, log_beliefs):
+        return opt.lookahead(state, goals, log_beliefs, alpha, log_likelihood, human_model,
+                lam, horizon, branch, prune)
 
-        u_R = opt.argmin(
-                opt.sample_controls(alpha, 100),
-                cost
-              )
+    def plan(alpha, state, goals, log_beliefs, past_u_r=None):
+        return minimize(alpha, objective(alpha, state, goals, log_beliefs), past_u_r)
 
-        return (u_R, new_beliefs)
+    def controller(alpha, state, goals, log_beliefs, past_u_r, u_h):
+        new_log_beliefs = belief.log_update(alpha, state, u_h, past_u_r, goals, log_beliefs, log_likelihood)
+        return (plan(alpha, state, goals, new_log_beliefs, past_u_r), new_log_beliefs)
+
+    controller.objective = objective
+    controller.plan = plan
+    controller.log_likelihood = log_likelihood
+    return controller
+
+def compiled(log_likelihood, lookup):
+    """
+        compiled looks its control up, in a precompiled policy,
+        instead of planning, see policy.compile
+
+        lookup maps (alpha, state, goals, beliefs) to the
+        control, e.g. policy.interpolator(policy.load(path))
+    """
+    def controller(alpha, state, goals, log_beliefs, past_u_r, u_h):
+        new_log_beliefs = belief.log_update(alpha, state, u_h, past_u_r, goals, log_beliefs, log_likelihood)
+        return (lookup(alpha, state, goals, np.exp(new_log_beliefs)), new_log_beliefs)
 
     return controller
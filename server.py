@@ -0,0 +1,373 @@
+import sys
+import json
+import time
+import asyncio
+import argparse
+
+import numpy as np
+
+import cache
+import sim
+
+# A server hosts many shared autonomy sessions, each a robot as in
+# sim.simulate, stepped by its client one human control at a time.
+# Steps that arrive within a short window of each other are run
+# together: sessions with the same robot and goals are stacked
+# into one batched belief update and plan, as sim.simulate_batch
+# does for the runs of a simulation.
+#
+#   python server.py serve --unix /tmp/duo.sock
+#   python server.py load --unix /tmp/duo.sock .test_examples/active=20.json --sessions 64
+#
+# The protocol is a json object per line, each request answered
+# in order with a line holding its "id":
+#
+#   {"id": 1, "op": "open", "conditions": {...}}   -> {"id": 1, "session": 0}
+#   {"id": 2, "op": "step", "session": 0, "u_h": [.1, 0]}
+#                                       -> {"id": 2, "u_r": [...], "beliefs": [...], "state": [...]}
+#   {"id": 3, "op": "close", "session": 0}         -> {"id": 3}
+#   {"id": 4, "op": "stats"}                       -> {"id": 4, "steps": ..., "batches": ...}
+#
+# a step may also give the "state", e.g. as measured, instead of
+# the one the server tracks. Errors are answered {"id", "error"}.
+
+ALPHA = 0.1
+
+def group_for(ics, alpha):
+    """
+        group_for is the key of the sessions that can be batched
+        together: the same robot, human model, likelihood and
+        goals. The start, prior and true goal are per session
+    """
+    return cache.canonical({
+        "conditions": {k: v for (k, v) in ics.items() if k not in ("start", "prior", "true_goal")},
+        "alpha": alpha,
+    })
+
+class Server:
+    """
+        Server is the sessions and the pending steps
+
+        pending steps are run window seconds after the first of
+        them arrived, or as soon as max_batch are pending
+    """
+
+    def __init__(self, window=0.002, max_batch=1024):
+        self.window = window
+        self.max_batch = max_batch
+
+        self.sessions = {}
+        self.robots = {}
+        self.next_session = 0
+
+        self.pending = []
+        self.timer = None
+
+        self.steps = 0
+        self.batches = 0
+        self.largest = 0
+
+    def open(self, ics, alpha=ALPHA):
+        """
+            open starts a session of the initial conditions,
+            checking its start and prior against the goals, as
+            every session of its group is batched with them
+        """
+        group = group_for(ics, alpha)
+        if group not in self.robots:
+            (start, goals, true_goal, human, robot, prior) = sim.configure(ics)
+            self.robots[group] = (robot, goals)
+        (robot, goals) = self.robots[group]
+
+        start = np.asarray(ics.get("start"), dtype=float)
+        if start.shape != goals.shape[1:]:
+            raise Exception("server.open: 'start' must have the " + repr(goals.shape[-1]) + " dimensions of the goals, got " + repr(ics.get("start")))
+        prior = np.asarray(ics.get("prior"), dtype=float)
+        if prior.shape != goals.shape[:1]:
+            raise Exception("server.open: 'prior' must have one belief per goal, " + repr(len(goals)) + ", got " + repr(ics.get("prior")))
+
+        with np.errstate(divide='ignore'):
+            log_beliefs = np.log(prior)
+
+        session = self.next_session
+        self.next_session += 1
+        self.sessions[session] = {
+            "group": group,
+            "alpha": alpha,
+            "state": start,
+            "log_beliefs": log_beliefs,
+            "past_u_r": np.zeros(start.shape),
+            "stepping": False,
+        }
+        return session
+
+    def close(self, session):
+        if session not in self.sessions:
+            raise Exception("server.close: no session " + repr(session))
+        del self.sessions[session]
+
+    def step(self, session, u_h, state=None):
+        """
+            step queues a step of the session
+
+            returns a future of its (u_r, beliefs, state)
+        """
+        s = self.sessions.get(session)
+        if s is None:
+            raise Exception("server.step: no session " + repr(session))
+        if s["stepping"]:
+            raise Exception("server.step: session " + repr(session) + " is already stepping")
+
+        # a malformed step would fail the whole batch it's stacked in
+        u_h = np.asarray(u_h, dtype=float)
+        if u_h.shape != s["state"].shape:
+            raise Exception("server.step: 'u_h' must have " + repr(len(s["state"])) + " dimensions, got " + repr(u_h.tolist()))
+        if state is not None:
+            state = np.asarray(state, dtype=float)
+            if state.shape != s["state"].shape:
+                raise Exception("server.step: 'state' must have " + repr(len(s["state"])) + " dimensions, got " + repr(state.tolist()))
+            s["state"] = state
+
+        s["stepping"] = True
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((session, u_h, future))
+
+        if len(self.pending) >= self.max_batch:
+            self.flush()
+        elif self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(self.window, self.flush)
+        return future
+
+    def flush(self):
+        """
+            flush runs the pending steps, a batch per group
+        """
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        (pending, self.pending) = (self.pending, [])
+
+        groups = {}
+        for p in pending:
+            if p[0] in self.sessions:
+                groups.setdefault(self.sessions[p[0]]["group"], []).append(p)
+            elif not p[2].done():
+                p[2].set_exception(Exception("server.step: session " + repr(p[0]) + " was closed"))
+
+        for (group, steps) in groups.items():
+            try:
+                self.run(group, steps)
+            except Exception as e:
+                for (session, u_h, future) in steps:
+                    self.sessions[session]["stepping"] = False
+                    if not future.done():
+                        future.set_exception(e)
+
+    def run(self, group, steps):
+        (robot, goals) = self.robots[group]
+        sessions = [self.sessions[session] for (session, u_h, future) in steps]
+        alpha = sessions[0]["alpha"]
+
+        states = np.stack([s["state"] for s in sessions])
+        log_beliefs = np.stack([s["log_beliefs"] for s in sessions])
+        past_u_r = np.stack([s["past_u_r"] for s in sessions])
+        u_h = np.stack([u for (session, u, future) in steps])
+
+        (u_r, log_beliefs) = robot(alpha, states, goals, log_beliefs, past_u_r, u_h)
+
+        self.steps += len(steps)
+        self.batches += 1
+        self.largest = max(self.largest, len(steps))
+
+        for (b, (s, (session, _, future))) in enumerate(zip(sessions, steps)):
+            s["state"] = states[b] + u_r[b]
+            s["log_beliefs"] = log_beliefs[b]
+            s["past_u_r"] = u_r[b]
+            s["stepping"] = False
+            if not future.done():
+                future.set_result((u_r[b], np.exp(log_beliefs[b]), s["state"]))
+
+    def stats(self):
+        return {
+            "sessions": len(self.sessions),
+            "steps": self.steps,
+            "batches": self.batches,
+            "mean_batch": self.steps / self.batches if self.batches else 0.0,
+            "largest_batch": self.largest,
+        }
+
+    async def request(self, r):
+        """
+            request answers one request of the protocol
+        """
+        op = r.get("op")
+        if op == "open":
+            return {"session": self.open(r["conditions"], r.get("alpha", ALPHA))}
+        if op == "step":
+            (u_r, beliefs, state) = await self.step(r["session"], r["u_h"], r.get("state"))
+            return {"u_r": u_r.tolist(), "beliefs": beliefs.tolist(), "state": state.tolist()}
+        if op == "close":
+            self.close(r["session"])
+            return {}
+        if op == "stats":
+            return self.stats()
+        raise Exception("server.request: unknown op " + repr(op))
+
+    async def handle(self, reader, writer):
+        """
+            handle serves a connection, answering its requests in
+            order; the sessions it opened are closed with it
+        """
+        opened = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+
+                r = {}
+                try:
+                    r = json.loads(line)
+                    response = await self.request(r)
+                    if r.get("op") == "open":
+                        opened.add(response["session"])
+                except Exception as e:
+                    response = {"error": str(e)}
+
+                response["id"] = r.get("id")
+                writer.write((json.dumps(response) + "\n").encode("utf-8"))
+                await writer.drain()
+        finally:
+            for session in opened:
+                self.sessions.pop(session, None)
+            writer.close()
+
+async def listen(server, unix=None, host="127.0.0.1", port=0):
+    """
+        listen serves server on the unix socket at path unix, or
+        else on host and port, 0 for any free port
+
+        returns the asyncio server, see asyncio.start_server
+    """
+    if unix is not None:
+        return await asyncio.start_unix_server(server.handle, unix)
+    return await asyncio.start_server(server.handle, host, port)
+
+async def connect(unix=None, host="127.0.0.1", port=0):
+    if unix is not None:
+        return await asyncio.open_unix_connection(unix)
+    return await asyncio.open_connection(host, port)
+
+class Client:
+    """
+        Client is a connection to a server, one request at a time
+    """
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.next_id = 0
+
+    async def call(self, op, **args):
+        self.next_id += 1
+        r = dict(args, op=op, id=self.next_id)
+        self.writer.write((json.dumps(r, default=lambda v: np.asarray(v).tolist()) + "\n").encode("utf-8"))
+        await self.writer.drain()
+
+        response = json.loads(await self.reader.readline())
+        if "error" in response:
+            raise Exception("server.Client: " + op + ": " + response["error"])
+        return response
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+async def drive(client, ics, steps, latencies):
+    """
+        drive runs a session of ics on the server for steps steps,
+        or until it reaches the goal, the human model of ics
+        simulated here; the latency of each step is appended to
+        latencies
+    """
+    (start, goals, true_goal, human, robot, prior) = sim.configure(ics)
+    session = (await client.call("open", conditions=ics))["session"]
+
+    state = np.asarray(start, dtype=float)
+    past_u_r = np.zeros(state.shape)
+    for i in range(steps):
+        if np.linalg.norm(state - goals[true_goal]) <= ALPHA:
+            break
+
+        u_h = human(ALPHA, state, goals[true_goal], past_u_r)
+        tick = time.perf_counter()
+        response = await client.call("step", session=session, u_h=u_h)
+        latencies.append(time.perf_counter() - tick)
+
+        past_u_r = np.asarray(response["u_r"])
+        state = np.asarray(response["state"])
+
+    await client.call("close", session=session)
+
+async def load(ics, sessions=16, steps=50, unix=None, host="127.0.0.1", port=0):
+    """
+        load drives sessions concurrent sessions of ics, each on
+        its own connection, and measures the server
+
+        returns the steps, seconds, throughput in steps per
+        second, latency percentiles in seconds and the server's
+        stats
+    """
+    clients = []
+    for i in range(sessions):
+        clients.append(Client(*(await connect(unix, host, port))))
+
+    latencies = []
+    tick = time.perf_counter()
+    await asyncio.gather(*[drive(c, ics, steps, latencies) for c in clients])
+    seconds = time.perf_counter() - tick
+
+    stats = await clients[0].call("stats")
+    for c in clients:
+        await c.close()
+
+    return {
+        "steps": len(latencies),
+        "seconds": seconds,
+        "throughput": len(latencies) / seconds,
+        "latency": {str(q): float(np.percentile(latencies, q)) for q in (50, 90, 99, 99.9)},
+        "server": stats,
+    }
+
+async def serve(window, max_batch, unix=None, host="127.0.0.1", port=0):
+    s = await listen(Server(window, max_batch), unix, host, port)
+    print("serving on", ", ".join(str(sock.getsockname()) for sock in s.sockets), file=sys.stderr)
+    async with s:
+        await s.serve_forever()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="serve shared autonomy sessions, or load test a server")
+    parser.add_argument("command", choices=["serve", "load"])
+    parser.add_argument("conditions", nargs="?", default=None,
+            help="for load, the initial conditions json file of the sessions")
+    parser.add_argument("--unix", default=None,
+            help="the unix socket path, instead of tcp")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7471)
+    parser.add_argument("--window", type=float, default=0.002,
+            help="seconds to wait for more steps to batch (default 0.002)")
+    parser.add_argument("--max-batch", type=int, default=1024,
+            help="run the pending steps once this many are waiting (default 1024)")
+    parser.add_argument("--sessions", type=int, default=16,
+            help="for load, the concurrent sessions (default 16)")
+    parser.add_argument("--steps", type=int, default=50,
+            help="for load, the most steps per session (default 50)")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        asyncio.run(serve(args.window, args.max_batch, args.unix, args.host, args.port))
+    else:
+        if args.conditions is None:
+            parser.error("load needs the initial conditions")
+        print(json.dumps(asyncio.run(load(sim.load(args.conditions), args.sessions, args.steps,
+                args.unix, args.host, args.port)), indent=4))
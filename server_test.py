@@ -0,0 +1,95 @@
+import asyncio
+
+import numpy as np
+
+import human
+import sim
+import server
+
+async def stepping():
+    ics = sim.load("./.test_examples/active=20.json")
+    (start, goals, true_goal, human_model, robot, prior) = sim.configure(ics)
+
+    # a window long enough that every session's step is batched
+    s = server.Server(window=0.05)
+    listening = await server.listen(s, port=0)
+    port = listening.sockets[0].getsockname()[1]
+
+    starts = [[0, 0], [0.3, -0.2], [-0.4, 0.1], [0.2, 0.5]]
+    clients = [server.Client(*(await server.connect(port=port))) for x in starts]
+    sessions = [(await c.call("open", conditions=dict(ics, start=x)))["session"] for (c, x) in zip(clients, starts)]
+
+    # each session steps as the robot would alone
+    states = np.asarray(starts, dtype=float)
+    log_beliefs = np.tile(np.log(prior), (len(starts), 1))
+    past_u_r = np.zeros(states.shape)
+    for i in range(3):
+        u_h = np.stack([human.optimal(.1, x, goals[true_goal], u) for (x, u) in zip(states, past_u_r)])
+        responses = await asyncio.gather(*[c.call("step", session=session, u_h=u)
+                for (c, session, u) in zip(clients, sessions, u_h)])
+
+        for (b, response) in enumerate(responses):
+            (want, log_beliefs[b]) = robot(.1, states[b], goals, log_beliefs[b], past_u_r[b], u_h[b])
+            if not (np.allclose(response["u_r"], want) and np.allclose(response["beliefs"], np.exp(log_beliefs[b]))):
+                raise Exception("test_server: session " + repr(b) + " got " + repr(response) + " want " + repr(want))
+            states[b] = states[b] + want
+            past_u_r[b] = want
+
+    stats = await clients[0].call("stats")
+    if not (stats["steps"] == 12 and stats["batches"] == 3 and stats["largest_batch"] == 4):
+        raise Exception("test_server: got stats " + repr(stats))
+
+    # errors are answered, not fatal
+    try:
+        await clients[0].call("step", session=1000, u_h=[.1, 0])
+        raise Exception("test_server: stepped a session that doesn't exist")
+    except Exception as e:
+        if "no session" not in str(e):
+            raise
+
+    # a malformed step fails only its own request, not the
+    # steps batched with it, and malformed sessions don't open
+    u_h = [human.optimal(.1, x, goals[true_goal], u) for (x, u) in zip(states, past_u_r)]
+    u_h[1] = [.1, 0, 0]
+    responses = await asyncio.gather(*[c.call("step", session=session, u_h=u)
+            for (c, session, u) in zip(clients, sessions, u_h)], return_exceptions=True)
+    if not ("dimensions" in str(responses[1]) and all(isinstance(r, dict) for (b, r) in enumerate(responses) if b != 1)):
+        raise Exception("test_server: malformed step got " + repr(responses))
+
+    for bad in [dict(ics, prior=[1.0]), dict(ics, start=[0, 0, 0])]:
+        try:
+            await clients[0].call("open", conditions=bad)
+            raise Exception("test_server: opened a session of " + repr(bad))
+        except Exception as e:
+            if "must have" not in str(e):
+                raise
+
+    await clients[0].call("close", session=sessions[0])
+    for c in clients:
+        await c.close()
+    listening.close()
+    await listening.wait_closed()
+
+async def loading():
+    ics = sim.load("./.test_examples/active=20.json")
+    listening = await server.listen(server.Server(), port=0)
+    port = listening.sockets[0].getsockname()[1]
+
+    result = await server.load(ics, sessions=8, steps=5, port=port)
+    if result["steps"] != 40 or result["server"]["batches"] >= 40:
+        raise Exception("test_load: got " + repr(result))
+    if not result["latency"]["50"] <= result["latency"]["99"]:
+        raise Exception("test_load: latencies " + repr(result["latency"]))
+
+    listening.close()
+    await listening.wait_closed()
+
+def test_server():
+    asyncio.run(stepping())
+
+def test_load():
+    asyncio.run(loading())
+
+if __name__ == '__main__':
+    test_server()
+    test_load()
@@ -6,6 +6,8 @@ import geo
 import human
 import robot
 import belief
+import opt
+import instrument
 
 np.random.seed(111)
 
@@ -16,31 +18,40 @@ ROBOT_TELEOP = "teleop"
 ROBOT_SHARED = "shared"
 ROBOT_INFO   = "info"
 ROBOT_ACTIVE = "active"
+ROBOT_ACTIVE_HORIZON = "active_horizon"
+ROBOT_COMPILED = "compiled"
 
 LIKELIHOOD_BOLTZMANN = "boltzmann"
 LIKELIHOOD_LAZY      = "lazy"
 
+OPTIMIZER_GRID   = "grid"
+OPTIMIZER_REFINE = "refine"
+OPTIMIZER_EXACT  = "exact"
+
 def likelihood_for(l, params):
     """
-        likelihood_for constructs a likelihood function
+        likelihood_for constructs a log-likelihood function
         for a particular model
 
         use to get a function corresponding to a particular
         declared likelihood
 
+        the log-likelihoods returned are vectorized over goals,
+        see belief.likelihoods and belief.log_update
+
         >>> likelihood_for(LIKELIHOOD_BOLTZMANN, {'temperature': 1})
     """
     if l == LIKELIHOOD_BOLTZMANN:
         if "temperature" not in params:
             raise Exception("sim.likelihood_for: " + repr(LIKELIHOOD_BOLTZMANN) + ": 'temperature' not in params")
 
-        return belief.boltzmann(params["temperature"])
+        return belief.log_boltzmann(params["temperature"])
 
     if l == LIKELIHOOD_LAZY:
         if "threshold" not in params:
             raise Exception("sim.likelihood_for: " + repr(LIKELIHOOD_LAZY) + ": threshold' not in params")
 
-        return belief.lazy(params["threshold"])
+        return belief.log_lazy(params["threshold"])
 
     raise Exception("sim.likelihood_for: likelihood model " + repr(l) + " not recognized")
 
@@ -69,9 +80,38 @@ def human_for(h, params):
 
     raise Exception("sim.human_for: human model " + repr(h) + " not recognized")
 
-def robot_for(r, h, likelihood, robot_params, human_params):
+def optimizer_for(params, d=2):
+    """
+        optimizer_for constructs the minimizer a robot plans
+        with, from the robot's params, in d dimensions
+
+        use to pick between the 100 point grid (the default),
+        coarse to fine search, and exact minimization of the
+        expected q (see opt.exact)
+
+        >>> optimizer_for({'optimizer': OPTIMIZER_REFINE, 'budget': 32})
     """
-        robot_for constructs a robot function for a particular model
+    o = params.get("optimizer", OPTIMIZER_GRID)
+
+    if o == OPTIMIZER_GRID:
+        return opt.grid(params.get("controls", 100), d)
+
+    if o == OPTIMIZER_REFINE:
+        return opt.refine(
+                coarse=params.get("coarse", 16),
+                budget=params.get("budget", 64),
+                tol=params.get("tol", 1e-4),
+                d=d)
+
+    if o == OPTIMIZER_EXACT:
+        return opt.exact(opt.grid(params.get("controls", 100), d))
+
+    raise Exception("sim.optimizer_for: optimizer " + repr(o) + " not recognized")
+
+def robot_for(r, h, likelihood, robot_params, human_params, d=2):
+    """
+        robot_for constructs a robot function for a particular
+        model, planning in d dimensions
 
         use to get a function corresponding to a particular robot
 
@@ -81,29 +121,69 @@ def robot_for(r, h, likelihood, robot_params, human_params):
     if r == ROBOT_TELEOP:
         return robot.teleop
 
+    # the human model the robot plans with, counting its calls and the reactions it predicts
+    def model(h, params):
+        return instrument.counted("human_model")(
+                instrument.counted("reactions", size=instrument.rows)(human_for(h, params)))
+
     if r == ROBOT_SHARED:
-        return robot.shared_sampled(likelihood, human_for(h, human_params))
+        return robot.shared_sampled(likelihood, model(h, human_params), optimizer_for(robot_params, d))
+
+    # a memo of posteriors, shared by the robot's planning and updates
+    memo = None
+    if robot_params.get("memo", 0) > 0:
+        memo = belief.Memo(robot_params["memo"])
 
     if r == ROBOT_INFO:
-        return robot.info(likelihood, human_for(h, human_params))
+        return robot.info(likelihood, model(h, human_params), optimizer_for(robot_params, d), memo)
 
     if r == ROBOT_ACTIVE:
         if "lambda" not in robot_params:
             raise Exception("sim.robot_for: " + repr(ROBOT_ACTIVE) + ": 'lambda' not in params")
 
-        return robot.active(likelihood, human_for(h, human_params), robot_params["lambda"])
+        return robot.active(likelihood, model(h, human_params), robot_params["lambda"], optimizer_for(robot_params, d), memo)
+
+    if r == ROBOT_ACTIVE_HORIZON:
+        if "lambda" not in robot_params:
+            raise Exception("sim.robot_for: " + repr(ROBOT_ACTIVE_HORIZON) + ": 'lambda' not in params")
+
+        return robot.active_horizon(likelihood, model(h, human_params), robot_params["lambda"],
+                robot_params.get("horizon", 2), optimizer_for(robot_params, d),
+                robot_params.get("branch", 8), robot_params.get("prune", 1e-3))
+
+    if r == ROBOT_COMPILED:
+        if "policy" not in robot_params:
+            raise Exception("sim.robot_for: " + repr(ROBOT_COMPILED) + ": 'policy' not in params")
+
+        # imported here, policy compiles with sim
+        import policy
+        return robot.compiled(likelihood, policy.interpolator(policy.load(robot_params["policy"])))
 
     raise Exception("sim.robot_for: robot model " + repr(r) + " not recognized")
 
 def save(filename, dictionary):
+    """
+        save writes dictionary as json, arrays as nested lists
+
+        use for conditions; use store for results
+    """
     with open(filename, 'w') as f:
-        json.dump(dictionary, f, indent=4)
+        json.dump(dictionary, f, indent=4, default=lambda v: np.asarray(v).tolist())
 
 def load(filename):
     with open(filename, 'r') as f:
         return json.load(f)
 
-def run(ics):
+def configure(ics):
+    """
+        configure constructs the arguments to simulate from
+        initial conditions
+
+        the start and goals may be in any number of dimensions,
+        2 or more, the robot planning in the same
+
+        returns (start, goals, true_goal, human, robot, prior)
+    """
     if "start" not in ics:
         raise Exception("sim.run: initial conditions must specify 'start'")
     start = np.asarray(ics["start"])
@@ -111,6 +191,8 @@ def run(ics):
     if "goals" not in ics:
         raise Exception("sim.run: initial conditions must specify 'goals'")
     goals = np.asarray(ics["goals"])
+    if goals.ndim != 2 or goals.shape[-1] != start.shape[-1]:
+        raise Exception("sim.run: 'goals' must be a list of points with the dimensions of 'start', got " + repr(ics["goals"]))
 
     if "true_goal" not in ics:
         raise Exception("sim.run: initial conditions must specify 'true_goal'")
@@ -139,21 +221,147 @@ def run(ics):
     robot_params = {}
     if "robot_params" in ics:
         robot_params = ics["robot_params"]
-    robot = robot_for(ics["robot"], ics["human"], likelihood, robot_params, human_params)
+    robot = robot_for(ics["robot"], ics["human"], likelihood, robot_params, human_params, len(start))
+
+    return (start, goals, true_goal, human, robot, prior)
+
+def history_for(ics):
+    """
+        history_for is how simulate keeps the history of the
+        initial conditions, from their optional "history":
+
+            "history": {"dtype": "float32", "beliefs_every": 10}
+
+        returns the dtype and every arguments of simulate
+    """
+    history = ics.get("history", {})
+    dtype = history.get("dtype", "float64")
+    if dtype not in ("float64", "float32"):
+        raise Exception("sim.history_for: dtype " + repr(dtype) + " not recognized, use float64 or float32")
+
+    every = history.get("beliefs_every", 1)
+    if not (isinstance(every, int) and every >= 1):
+        raise Exception("sim.history_for: beliefs_every must be a positive integer, got " + repr(every))
+
+    return {"dtype": np.dtype(dtype), "every": every}
+
+def run(ics, seed=None, cache=None, instrumented=False):
+    """
+        run simulates the initial conditions
+
+        seed, if given, seeds numpy's random state first
+
+        cache is an optional cache.Cache, consulted before
+        simulating and filled after
 
-    (traj, bs, u_h, u_r) = simulate(start, goals, true_goal, human, robot, prior)
-    return result(ics, traj, bs, u_h, u_r)
+        instrumented records per-step timings and counts as
+        the result's "instrumentation", see instrument.Recorder;
+        instrumented runs bypass the cache
 
-def result(ics, traj, beliefs, u_h, u_r):
+        a robot with a memo (robot_params "memo": entries)
+        reports its hit rate as the result's "memo"
+
+        the history is kept as the conditions' "history" asks,
+        see history_for
+    """
+    if instrumented:
+        cache = None
+
+    if cache is not None:
+        r = cache.get(ics, seed)
+        if r is not None:
+            return r
+
+    if seed is not None:
+        np.random.seed(seed)
+
+    recorder = instrument.Recorder() if instrumented else None
+    args = configure(ics)
+    (traj, log_bs, u_h, u_r) = simulate(*args, recorder=recorder, **history_for(ics))
+    r = result(ics, traj, log_bs, u_h, u_r)
+    if recorder is not None:
+        r["instrumentation"] = recorder.summary()
+    if getattr(args[4], "memo", None) is not None:
+        r["memo"] = args[4].memo.stats()
+
+    if cache is not None:
+        cache.put(ics, seed, r)
+    return r
+
+def run_batch(ics, runs, seed=None, cache=None, instrumented=False):
+    """
+        run_batch runs the initial conditions runs times,
+        in lockstep, see simulate_batch
+
+        seed, cache and instrumented are as for run; the runs
+        share the batch's instrumentation
+
+        returns a list of results, one per run
+    """
+    if instrumented:
+        cache = None
+
+    if cache is not None:
+        rs = cache.get(ics, seed, runs)
+        if rs is not None:
+            return rs
+
+    if seed is not None:
+        np.random.seed(seed)
+
+    recorder = instrument.Recorder() if instrumented else None
+    rs = [result(ics, traj, log_bs, u_h, u_r)
+            for (traj, log_bs, u_h, u_r) in simulate_batch(*configure(ics), runs=runs, recorder=recorder, **history_for(ics))]
+    if recorder is not None:
+        summary = recorder.summary()
+        summary["runs"] = runs
+        for r in rs:
+            r["instrumentation"] = summary
+
+    if cache is not None:
+        cache.put(ics, seed, rs, runs)
+    return rs
+
+def result(ics, traj, log_beliefs, u_h, u_r):
     return {
         "conditions": ics,
         "trajectory": traj,
-        "beliefs": beliefs,
+        "beliefs": np.exp(log_beliefs),
+        "log_beliefs": log_beliefs,
         "u_h": u_h,
         "u_r": u_r,
     }
 
-def simulate(start, goals, true_goal, Fu_h, Fu_r, prior, alpha=0.1, maxiters=100):
+def recorded(steps, every):
+    """
+        recorded is the number of beliefs kept of a run of
+        steps steps, keeping every every-th and the last
+    """
+    return steps//every + 1 + (steps % every > 0)
+
+def kept_steps(steps, every):
+    """
+        kept_steps is the step of each of the recorded beliefs
+        of a run of steps steps, see recorded
+    """
+    kept = np.arange(0, steps + 1, every)
+    if kept[-1] != steps:
+        kept = np.append(kept, steps)
+    return kept
+
+def belief_steps(r):
+    """
+        belief_steps is the step of each of a result's beliefs,
+        e.g. [0, 10, 20, 23] for a run of 23 steps keeping the
+        beliefs of every 10th, see history_for
+
+        use to line up the beliefs of runs by step, rather
+        than by index
+    """
+    return kept_steps(len(r["u_r"]), history_for(r["conditions"])["every"])
+
+def simulate(start, goals, true_goal, Fu_h, Fu_r, prior, alpha=0.1, maxiters=100, recorder=None,
+        dtype=float, every=1):
     """
         run a simulation
 
@@ -165,29 +373,135 @@ def simulate(start, goals, true_goal, Fu_h, Fu_r, prior, alpha=0.1, maxiters=100
         alpha is maximum norm of step size
         maxiters terminates if goal isn't reached in num of steps
 
-        returns the traj taken and the history of beliefs
+        recorder, an instrument.Recorder, if given records
+        the time spent in the human and robot, and the phases
+        within them, per step
+
+        dtype is the dtype the history is kept in, e.g.
+        np.float32 to halve it; the simulation itself runs in
+        float64. every keeps the beliefs of every every-th
+        step only, and the last, see recorded
+
+        returns the traj taken and the history of beliefs,
+        as log-beliefs
     """
-    current = np.copy(start)
+    if recorder is not None:
+        Fu_h = instrument.timed("human")(Fu_h)
+        Fu_r = instrument.timed("robot")(Fu_r)
+
+    current = np.array(start, dtype=float)
     goal = goals[true_goal]
-    beliefs = prior
-    trajectory = [current]
-    belief_hist = [beliefs]
-    u_hs = []
-    u_rs = [np.array([0.0, 0.0])]
+    with np.errstate(divide='ignore'):
+        log_beliefs = np.log(prior)
+    past_u_r = np.zeros(current.shape)
+
+    trajectory = np.empty((maxiters + 1,) + current.shape, dtype=dtype)
+    belief_hist = np.empty((recorded(maxiters, every),) + np.shape(log_beliefs), dtype=dtype)
+    u_hs = np.empty((maxiters,) + current.shape, dtype=dtype)
+    u_rs = np.empty((maxiters,) + current.shape, dtype=dtype)
+    trajectory[0] = current
+    belief_hist[0] = log_beliefs
 
     iters = 0
-    while geo.norm(current - goal) > alpha and iters < maxiters:
-        u_h = Fu_h(alpha, current, goal, u_rs[-1])
-        u_hs.append(u_h)
-        (u_r, beliefs) = Fu_r(alpha, current, goals, beliefs, u_rs[-1], u_h)
-        u_rs.append(u_r)
-        belief_hist.append(beliefs)
+    with instrument.recording(recorder):
+        while geo.norm(current - goal) > alpha and iters < maxiters:
+            u_h = Fu_h(alpha, current, goal, past_u_r)
+            (u_r, log_beliefs) = Fu_r(alpha, current, goals, log_beliefs, past_u_r, u_h)
+
+            if geo.norm(u_r) > alpha + 1e-5:
+                raise Exception("sim.simulate: invalid u_r! u_r = " + repr(u_r) + "with norm = " + repr(geo.norm(u_r)))
+
+            current = current + u_r
+            past_u_r = u_r
+            iters += 1
+
+            trajectory[iters] = current
+            u_hs[iters - 1] = u_h
+            u_rs[iters - 1] = u_r
+            if iters % every == 0:
+                belief_hist[iters // every] = log_beliefs
+
+            if recorder is not None:
+                recorder.step(iters, current, log_beliefs, u_h, u_r)
+
+    kept = recorded(iters, every)
+    belief_hist[kept - 1] = log_beliefs
+    return (trajectory[:iters + 1], belief_hist[:kept], u_hs[:iters], u_rs[:iters])
+
+def simulate_batch(start, goals, true_goal, Fu_h, Fu_r, prior, runs, alpha=0.1, maxiters=100, recorder=None,
+        dtype=float, every=1):
+    """
+        run many independent simulations in lockstep
 
-        if geo.norm(u_r) > alpha + 1e-5:
-            raise Exception("sim.simulate: invalid u_r! u_r = " + repr(u_r) + "with norm = " + repr(geo.norm(u_r)))
+        same as simulate, but advances runs copies of the
+        simulation together: states are a (runs, 2) stack and
+        beliefs a (runs, K) stack, so Fu_h and Fu_r are called
+        once per step for all of the runs still going. Runs that
+        reach the goal, or maxiters, drop out of the stack.
 
-        current = current + u_r
-        trajectory.append(current)
-        iters += 1
+        the runs only differ if Fu_h or Fu_r are stochastic,
+        e.g. a fuzzed human.
 
-    return (trajectory, np.asarray(belief_hist), np.asarray(u_hs), np.asarray(u_rs[1:]))
+        recorder is as for simulate, a step records all of the
+        runs still going, and dtype and every are too
+
+        returns a list with the (traj, log-beliefs, u_h, u_r)
+        of each run, as simulate would
+    """
+    if recorder is not None:
+        Fu_h = instrument.timed("human")(Fu_h)
+        Fu_r = instrument.timed("robot")(Fu_r)
+
+    start = np.asarray(start, dtype=float)
+    goal = goals[true_goal]
+    with np.errstate(divide='ignore'):
+        log_prior = np.log(prior)
+
+    current = np.tile(start, (runs, 1))
+    log_beliefs = np.tile(log_prior, (runs, 1))
+    past_u_r = np.zeros((runs,) + start.shape)
+
+    trajectory = np.empty((maxiters + 1,) + current.shape, dtype=dtype)
+    belief_hist = np.empty((recorded(maxiters, every),) + log_beliefs.shape, dtype=dtype)
+    u_hs = np.empty((maxiters,) + current.shape, dtype=dtype)
+    u_rs = np.empty((maxiters,) + current.shape, dtype=dtype)
+    trajectory[0] = current
+    belief_hist[0] = log_beliefs
+
+    # runs that are still going, and the steps each took
+    going = geo.norm(current - goal, axis=-1) > alpha
+    steps = np.zeros(runs, dtype=int)
+
+    iters = 0
+    with instrument.recording(recorder):
+        while going.any() and iters < maxiters:
+            i = np.flatnonzero(going)
+
+            u_h = Fu_h(alpha, current[i], goal, past_u_r[i])
+            (u_r, log_beliefs[i]) = Fu_r(alpha, current[i], goals, log_beliefs[i], past_u_r[i], u_h)
+
+            norms = geo.norm(u_r, axis=-1)
+            if np.any(norms > alpha + 1e-5):
+                raise Exception("sim.simulate_batch: invalid u_r! u_r = " + repr(u_r) + "with norms = " + repr(norms))
+
+            current[i] = current[i] + u_r
+            past_u_r[i] = u_r
+
+            trajectory[iters + 1, i] = current[i]
+            u_hs[iters, i] = u_h
+            u_rs[iters, i] = u_r
+
+            steps[i] += 1
+            iters += 1
+            if iters % every == 0:
+                belief_hist[iters // every, i] = log_beliefs[i]
+            going[i] = geo.norm(current[i] - goal, axis=-1) > alpha
+
+            if recorder is not None:
+                recorder.step(iters, current[i], log_beliefs[i], u_h, u_r)
+
+    kept = [recorded(s, every) for s in steps]
+    for b in range(runs):
+        belief_hist[kept[b] - 1, b] = log_beliefs[b]
+    return [(trajectory[:steps[b] + 1, b], belief_hist[:kept[b], b], u_hs[:steps[b], b], u_rs[:steps[b], b])
+            for b in range(runs)]
@@ -10,7 +10,7 @@ def test_run():
     cases = [ "teleop", "shared", "active=1", "active=20", "active=100" ]
     for case in cases:
         ics  = sim.load("./.test_examples/" + case + ".json")
-        want = np.load("./.test_examples/" + case + ".npy")
+        want = np.load("./.test_examples/" + case + ".npy", allow_pickle=True, encoding="latin1")
 
         try:
             got  = sim.run(ics)
@@ -50,6 +50,84 @@ def test_run():
         except Exception as e:
             print("sim_test.test_run: while running " + repr(case) + ", " + repr(e))
 
+def test_run_batch():
+    cases = [ "teleop", "shared", "active=1", "active=20", "active=100" ]
+    for case in cases:
+        ics = sim.load("./.test_examples/" + case + ".json")
+
+        # these conditions are deterministic, so each run in the
+        # batch should match a single run
+        want = sim.run(ics)
+        for got in sim.run_batch(ics, 3):
+            for key in ["trajectory", "beliefs", "u_h", "u_r"]:
+                if not (np.shape(got[key]) == np.shape(want[key]) and np.allclose(got[key], want[key])):
+                    raise Exception("sim_test.test_run_batch: " + repr(case) + ": " + key + " isn't matching")
+
+def test_run_batch_done():
+    ics = sim.load("./.test_examples/shared.json")
+    ics["human_params"] = {"variance": 0.05}
+    ics["robot"] = "active"
+    ics["robot_params"] = {"lambda": 50}
+
+    goal = np.asarray(ics["goals"][ics["true_goal"]])
+    results = sim.run_batch(ics, 10)
+
+    if len(set([len(r["u_r"]) for r in results])) < 2:
+        raise Exception("sim_test.test_run_batch_done: expected runs of different lengths")
+
+    for r in results:
+        if not (len(r["trajectory"]) == len(r["beliefs"]) == len(r["u_h"]) + 1 == len(r["u_r"]) + 1):
+            raise Exception("sim_test.test_run_batch_done: ragged result")
+
+        distances = np.linalg.norm(r["trajectory"] - goal, axis=-1)
+        if not (distances[-1] <= 0.1 and np.all(distances[:-1] > 0.1)):
+            raise Exception("sim_test.test_run_batch_done: run didn't stop at the goal")
+
+def test_run_dimensions():
+    cases = [
+        ([0, .5, 0], [[1, 1, 0], [1, 0, 1]]),
+        ([0, .5, 0, 0], [[1, 1, 0, 1], [1, 0, 1, 0], [0, 0, 1, 1]]),
+    ]
+    for (start, goals) in cases:
+        for robot in ["shared", "active"]:
+            ics = sim.load("./.test_examples/active=20.json")
+            ics.update(start=start, goals=goals, prior=[1.0/len(goals)]*len(goals), robot=robot)
+
+            r = sim.run(ics)
+            distances = np.linalg.norm(r["trajectory"] - np.asarray(goals[0]), axis=-1)
+            if not (np.shape(r["u_r"])[-1] == len(start) and distances[-1] <= 0.1):
+                raise Exception("sim_test.test_run_dimensions: " + repr(len(start)) + "d " + robot + " didn't reach the goal")
+
+            # batches of runs match too
+            got = sim.run_batch(ics, 2)[1]
+            if not np.allclose(got["trajectory"], r["trajectory"]):
+                raise Exception("sim_test.test_run_dimensions: " + repr(len(start)) + "d " + robot + " batch isn't matching")
+
+def test_history():
+    ics = sim.load("./.test_examples/active=20.json")
+    want = sim.run(ics)
+    steps = len(want["u_r"])
+
+    for every in [1, 3, steps, steps + 5]:
+        compact = dict(ics, history={"dtype": "float32", "beliefs_every": every})
+        for got in [sim.run(compact)] + sim.run_batch(compact, 2):
+            # every every-th belief, and the last
+            kept = list(range(0, steps + 1, every))
+            if kept[-1] != steps:
+                kept.append(steps)
+
+            if got["trajectory"].dtype != np.float32 or got["beliefs"].dtype != np.float32:
+                raise Exception("sim_test.test_history: kept " + repr(got["trajectory"].dtype) + ", want float32")
+            if not np.allclose(got["trajectory"], want["trajectory"], atol=1e-6):
+                raise Exception("sim_test.test_history: every " + repr(every) + ": trajectory isn't matching")
+            if not (len(got["beliefs"]) == len(kept) and np.allclose(got["beliefs"], want["beliefs"][kept], atol=1e-6)):
+                raise Exception("sim_test.test_history: every " + repr(every) + ": got beliefs " + repr(got["beliefs"]))
+            if list(sim.belief_steps(got)) != kept:
+                raise Exception("sim_test.test_history: every " + repr(every) + ": got steps " + repr(sim.belief_steps(got)))
 
 if __name__ == '__main__':
     test_run()
+    test_run_batch()
+    test_run_batch_done()
+    test_run_dimensions()
+    test_history()
@@ -0,0 +1,254 @@
+import os
+import json
+
+import numpy as np
+
+# A store is a directory holding the results of an experiment
+# column by column:
+#
+#   index.json      the variables, their conditions and the run count
+#   runs.i8         (N, 2) the variable index and repetition of each run
+#   <column>.f8     every run's rows of the column, concatenated
+#   <column>.off    (N + 1) offsets into <column>.f8, in elements
+#
+# so runs are appended by appending to each file, and read back by
+# memory-mapping only the columns, and slicing only the runs, needed.
+#
+# The beliefs aren't stored, they're read as exp of the log beliefs.
+
+FORMAT = "duo-store-2"
+
+COLUMNS = ["trajectory", "log_beliefs", "u_h", "u_r"]
+
+# the columns of a result, stored or derived from a stored one
+FIELDS = COLUMNS + ["beliefs"]
+DERIVED = {"beliefs": ("log_beliefs", np.exp)}
+
+def widths(ics):
+    """
+        the row width of each column for a run of ics
+    """
+    d = len(ics["start"])
+    K = len(ics["goals"])
+    return {
+        "trajectory": d,
+        "log_beliefs": K,
+        "u_h": d,
+        "u_r": d,
+    }
+
+class Writer:
+    """
+        Writer appends results to a store, creating it if
+        it doesn't exist
+
+        with resume, an existing store is appended to rather
+        than overwritten; anything past its last complete run,
+        e.g. from a crash mid-append, is discarded
+    """
+
+    def __init__(self, path, dtype=np.float64, resume=False):
+        self.path = path
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        if resume and os.path.exists(os.path.join(path, "index.json")):
+            self.reopen()
+            return
+
+        self.dtype = np.dtype(dtype)
+        self.index = {
+            "format": FORMAT,
+            "dtype": self.dtype.str,
+            "columns": COLUMNS,
+            "variables": [],
+            "conditions": {},
+            "runs": 0,
+        }
+        self.offsets = {col: 0 for col in COLUMNS}
+        self.counts = {}
+
+        self.files = {"runs": open(os.path.join(path, "runs.i8"), 'wb')}
+        for col in COLUMNS:
+            self.files[col] = open(os.path.join(path, col + ".f8"), 'wb')
+            self.files[col + ".off"] = open(os.path.join(path, col + ".off"), 'wb')
+            self.files[col + ".off"].write(np.zeros(1, dtype=np.int64).tobytes())
+
+    def reopen(self):
+        with open(os.path.join(self.path, "index.json"), 'r') as f:
+            self.index = json.load(f)
+        if self.index.get("format") != FORMAT:
+            raise Exception("store.Writer: " + repr(self.path) + " is not a " + repr(FORMAT) + " store")
+
+        self.dtype = np.dtype(self.index["dtype"])
+        n = self.index["runs"]
+
+        def truncate(name, size):
+            with open(os.path.join(self.path, name), 'r+b') as f:
+                f.truncate(size)
+            return open(os.path.join(self.path, name), 'ab')
+
+        self.offsets = {}
+        self.files = {}
+        for col in COLUMNS:
+            offsets = np.fromfile(os.path.join(self.path, col + ".off"), dtype=np.int64, count=n + 1)
+            self.offsets[col] = int(offsets[n])
+            self.files[col] = truncate(col + ".f8", self.offsets[col]*self.dtype.itemsize)
+            self.files[col + ".off"] = truncate(col + ".off", (n + 1)*8)
+
+        runs = np.fromfile(os.path.join(self.path, "runs.i8"), dtype=np.int64, count=2*n).reshape(-1, 2)
+        self.files["runs"] = truncate("runs.i8", n*16)
+        self.counts = {name: int(np.sum(runs[:, 0] == v)) for (v, name) in enumerate(self.index["variables"])}
+
+    def count(self, name):
+        """
+            count is the number of runs of variable name stored
+        """
+        return self.counts.get(name, 0)
+
+    def append(self, name, rep, result):
+        """
+            append adds one run's result, the rep-th repetition
+            of variable name
+        """
+        if name not in self.index["conditions"]:
+            self.index["variables"].append(name)
+            self.index["conditions"][name] = result["conditions"]
+        v = self.index["variables"].index(name)
+
+        for col in COLUMNS:
+            data = np.asarray(result[col], dtype=self.dtype).ravel()
+            self.files[col].write(data.tobytes())
+            self.offsets[col] += data.size
+            self.files[col + ".off"].write(np.array([self.offsets[col]], dtype=np.int64).tobytes())
+
+        self.files["runs"].write(np.array([v, rep], dtype=np.int64).tobytes())
+        self.index["runs"] += 1
+        self.counts[name] = self.count(name) + 1
+
+    def flush(self):
+        """
+            flush makes the runs appended so far readable
+        """
+        for f in self.files.values():
+            f.flush()
+
+        tmp = os.path.join(self.path, "index.json.tmp")
+        with open(tmp, 'w') as f:
+            json.dump(self.index, f, indent=4)
+        os.replace(tmp, os.path.join(self.path, "index.json"))
+
+    def close(self):
+        self.flush()
+        for f in self.files.values():
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def write(path, results):
+    """
+        write saves the results of exp.run to a store at path
+
+        results is {name: result} or {name: [results]}
+    """
+    with Writer(path) as w:
+        for name in results:
+            rs = results[name]
+            if type(rs) == dict:
+                rs = [rs]
+            for (i, r) in enumerate(rs):
+                w.append(name, i, r)
+
+class Store:
+    """
+        Store reads a store, memory-mapping columns on first use
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "index.json"), 'r') as f:
+            self.index = json.load(f)
+
+        if self.index.get("format") != FORMAT:
+            raise Exception("store.Store: " + repr(path) + " is not a " + repr(FORMAT) + " store")
+
+        self.dtype = np.dtype(self.index["dtype"])
+        self.variables = self.index["variables"]
+        self.conditions = self.index["conditions"]
+        self.runs = np.fromfile(os.path.join(path, "runs.i8"), dtype=np.int64,
+                        count=2*len(self)).reshape(-1, 2)
+        self.mapped = {}
+
+    def __len__(self):
+        return self.index["runs"]
+
+    def column(self, col):
+        """
+            column is the (data, offsets) of col, memory-mapped
+        """
+        if col not in self.mapped:
+            if col not in self.index["columns"]:
+                raise Exception("store.Store.column: no column " + repr(col))
+
+            offsets = np.fromfile(os.path.join(self.path, col + ".off"), dtype=np.int64,
+                        count=len(self) + 1)
+            if offsets[-1] == 0:
+                data = np.zeros(0, dtype=self.dtype)
+            else:
+                data = np.memmap(os.path.join(self.path, col + ".f8"), dtype=self.dtype,
+                        mode='r', shape=(offsets[-1],))
+            self.mapped[col] = (data, offsets)
+        return self.mapped[col]
+
+    def get(self, col, i):
+        """
+            get is column col of run i, as a (rows, width) view;
+            a derived column, e.g. beliefs, is computed instead
+        """
+        if col in DERIVED:
+            (stored, f) = DERIVED[col]
+            return f(self.get(stored, i))
+
+        (data, offsets) = self.column(col)
+        name = self.variables[self.runs[i, 0]]
+        width = widths(self.conditions[name])[col]
+        return data[offsets[i]:offsets[i + 1]].reshape(-1, width)
+
+    def select(self, name):
+        """
+            select is the indices of the runs of variable name,
+            in order of repetition
+        """
+        v = self.variables.index(name)
+        runs = np.flatnonzero(self.runs[:, 0] == v)
+        return runs[np.argsort(self.runs[runs, 1], kind='stable')]
+
+    def result(self, i, columns=FIELDS):
+        """
+            result is run i as a sim.result dict, with only the
+            requested columns, each a view into the store but
+            the derived ones
+        """
+        r = {"conditions": self.conditions[self.variables[self.runs[i, 0]]]}
+        for col in columns:
+            r[col] = self.get(col, i)
+        return r
+
+    def results(self, columns=FIELDS):
+        """
+            results is the store in the structure exp.run returns,
+            {name: result} or {name: [results]}
+        """
+        results = {}
+        for name in self.variables:
+            rs = [self.result(i, columns) for i in self.select(name)]
+            results[name] = rs[0] if len(rs) == 1 else rs
+        return results
+
+def load(path):
+    return Store(path)
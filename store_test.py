@@ -0,0 +1,65 @@
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+import sim
+import store
+
+def test_write():
+    path = tempfile.mkdtemp()
+    try:
+        ics = sim.load("./.test_examples/shared.json")
+        noisy = dict(ics, human_params={"variance": 0.05})
+        teleop = sim.load("./.test_examples/teleop.json")
+        results = {
+            "noisy": sim.run_batch(noisy, 4),
+            "teleop": sim.run(teleop),
+        }
+
+        store.write(path, results)
+        got = store.load(path).results()
+
+        if not (len(got["noisy"]) == 4 and type(got["teleop"]) == dict):
+            raise Exception("test_write: results don't have the structure of exp.run")
+
+        for (name, want) in [("teleop", [results["teleop"]]), ("noisy", results["noisy"])]:
+            rs = got[name]
+            if type(rs) == dict:
+                rs = [rs]
+            for (g, w) in zip(rs, want):
+                if g["conditions"] != w["conditions"]:
+                    raise Exception("test_write: " + name + ": conditions aren't matching")
+                for col in store.FIELDS:
+                    if not (np.shape(g[col]) == np.shape(w[col]) and np.allclose(g[col], w[col])):
+                        raise Exception("test_write: " + name + ": " + col + " isn't matching")
+    finally:
+        shutil.rmtree(path)
+
+def test_columns():
+    path = tempfile.mkdtemp()
+    try:
+        ics = sim.load("./.test_examples/active=1.json")
+        store.write(path, {"active": sim.run_batch(ics, 3)})
+
+        s = store.load(path)
+        r = s.result(s.select("active")[2], columns=["u_r"])
+
+        if "trajectory" in r or "trajectory" in s.mapped:
+            raise Exception("test_columns: read a column that wasn't requested")
+        if not np.allclose(r["u_r"], sim.run(ics)["u_r"]):
+            raise Exception("test_columns: u_r isn't matching")
+
+        # the beliefs are read from the log beliefs, not stored
+        if os.path.exists(os.path.join(path, "beliefs.f8")):
+            raise Exception("test_columns: stored the beliefs as well as the log beliefs")
+        r = s.result(s.select("active")[2], columns=["beliefs"])
+        if not (list(s.mapped) == ["u_r", "log_beliefs"] and np.allclose(r["beliefs"], sim.run(ics)["beliefs"])):
+            raise Exception("test_columns: beliefs aren't matching")
+    finally:
+        shutil.rmtree(path)
+
+if __name__ == '__main__':
+    test_write()
+    test_columns()
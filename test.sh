@@ -1,7 +1,15 @@
 #!/bin/bash
+set -e
 
 python geo_test.py
 python opt_test.py
 python belief_test.py
 python sim_test.py
 python exp_test.py
+python cache_test.py
+python store_test.py
+python instrument_test.py
+python bench_test.py
+python policy_test.py
+python controller_test.py
+python server_test.py